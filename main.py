@@ -9,22 +9,35 @@ import tempfile
 from pyrogram import Client, idle, errors, filters
 from pyrogram.enums.parse_mode import ParseMode
 from pyrogram.raw.functions.account import GetAuthorizations, DeleteAccount
-from pymongo import MongoClient
 import requests
 import asyncio
 
 from utils import config
 from utils.db import db
 from utils.misc import gitrepo, userbot_version
+from utils.names import names
+from utils.peers import peers
+from utils.tmute import tmutes
 from utils.scripts import restart
 from utils.rentry import rentry_cleanup_job
 from utils.module import ModuleManager
-
-# Config MongoDB
-MONGO_URI = os.getenv("MONGO_URI")
-MONGO_DB = os.getenv("MONGO_DB", "telegram_logs")
-mongo_client = MongoClient(MONGO_URI)
-mongo_collection = mongo_client[MONGO_DB]["messages"]
+from utils.mongo_logger import MessageLogWriter, get_log_collection
+from utils.media_store import MediaDownloader
+
+# Config MongoDB (mesmo pool de conexões do utils.db quando a URI é a mesma)
+message_log = MessageLogWriter(
+    get_log_collection(),
+    batch_size=config.log_batch_size,
+    flush_interval=config.log_flush_interval,
+    max_queue=config.log_queue_size,
+    drop_policy=config.log_drop_policy,
+)
+media_downloader = MediaDownloader(
+    config.media_dir or os.path.join(tempfile.gettempdir(), "moon_media"),
+    workers=config.media_workers,
+    max_queue=config.media_queue_size,
+    max_size=config.media_max_size,
+)
 
 # Diretório do script
 SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
@@ -91,31 +104,37 @@ def load_missing_modules():
 # Função para logar mensagens no MongoDB
 async def log_message(message):
     try:
-        temp_dir = tempfile.gettempdir()
-        media_path = None
-        if message.media:
-            media_path = await message.download(file_name=os.path.join(temp_dir, f"{message.chat.id}_{message.message_id}"))
-            logging.info(f"Mídia baixada: {media_path}")
+        # Download da mídia fica com os workers, o registro não espera por ele
+        file_unique_id = media_downloader.submit(message) if message.media else None
 
         data = {
             "chat_id": message.chat.id,
             "chat_title": getattr(message.chat, "title", None),
-            "message_id": message.message_id,
+            "message_id": message.id,
             "from_user_id": message.from_user.id if message.from_user else None,
             "username": getattr(message.from_user, "username", None) if message.from_user else None,
             "first_name": getattr(message.from_user, "first_name", None) if message.from_user else None,
             "text": message.text or "",
             "has_media": bool(message.media),
             "media_type": str(message.media) if message.media else None,
+            "file_unique_id": file_unique_id,
             "date": message.date.isoformat(),
         }
 
-        mongo_collection.insert_one(data)
-        logging.info(f"[MONGODB] Mensagem salva: {data}")
+        # Gravação em lote no background (write-behind)
+        await message_log.put(data)
 
     except Exception as e:
         logging.error(f"[LOGGER] Erro ao salvar mensagem: {e}")
 
+# Criação de índices em background, sem atrasar o start
+async def bootstrap_indexes():
+    for name, ensure in (("database", db.ensure_indexes), ("message log", message_log.ensure_indexes)):
+        try:
+            await asyncio.to_thread(ensure)
+        except Exception as e:
+            logging.warning("Falha ao criar índices (%s): %s", name, e)
+
 # Main
 async def main():
     DeleteAccount.__new__ = None
@@ -154,12 +173,24 @@ async def main():
     logging.info("Moon-Userbot started!")
 
     app.loop.create_task(rentry_cleanup_job())
+    message_log.start()
+    app.loop.create_task(bootstrap_indexes())
+    app.loop.create_task(tmutes.sweeper(config.tmute_sweep_interval))
+    media_downloader.start()
 
     @app.on_message(filters.all)
     async def all_messages_handler(client, message):
         await log_message(message)
 
+    # Perfis alterados saem do cache de peers e de nomes
+    # (grupos separados, só o primeiro handler de cada grupo é executado)
+    app.on_raw_update(group=-1)(peers.on_raw_update)
+    app.on_raw_update(group=-2)(names.on_raw_update)
+
     await idle()
+    await media_downloader.close()
+    await message_log.close()
+    db.flush()
     await app.stop()
 
 if __name__ == "__main__":
@@ -14,21 +14,24 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from contextlib import suppress
+import asyncio
+import re
+import threading
 
 from pyrogram.enums import ChatType
 from pyrogram import Client, ContinuePropagation, filters
 from pyrogram.errors import (
     UserAdminInvalid,
     ChatAdminRequired,
-    RPCError,
 )
 from pyrogram.raw import functions
 from pyrogram.types import Message, ChatPermissions
 
-from utils.db import db
+from utils.actions import ActionQueue, DeleteBatcher
+from utils.db import bus, db
 from utils.scripts import format_exc, with_reply
 from utils.misc import modules_help, prefix
+from utils.tmute import tmutes
 
 from utils.handlers import (
     BanHandler,
@@ -45,55 +48,113 @@ from utils.handlers import (
     AntiChannelsHandler,
     DeleteHistoryHandler,
     AntiRaidHandler,
+    BulkModerationHandler,
 )
 
 
 db_cache: dict = db.get_collection("core.ats")
+stale: set = set()
+stale_lock = threading.Lock()
+CHAT_SUFFIX = re.compile(r"-?\d+$")
 
 
-def update_cache():
-    db_cache.clear()
-    db_cache.update(db.get_collection("core.ats"))
+def drop_policies(variables):
+    for var in variables:
+        chat_id = CHAT_SUFFIX.search(var)
+        if chat_id is None:
+            policies.clear()
+        else:
+            policies.pop(int(chat_id.group()), None)
+
+
+def on_ats_change(_, variables):
+    """Invalidation bus callback, may run in a database thread"""
+    with stale_lock:
+        if variables is None:
+            stale.add(None)
+            policies.clear()
+        else:
+            stale.update(variables)
+            drop_policies(variables)
+
+
+def refresh_cache():
+    """Re-read only the core.ats values written since the last refresh"""
+    with stale_lock:
+        if not stale:
+            return
+        variables = set(stale)
+        stale.clear()
+    if None in variables:
+        db_cache.clear()
+        db_cache.update(db.get_collection("core.ats"))
+        policies.clear()
+        return
+    for var, value in db.get_many("core.ats", variables).items():
+        if value is None:
+            db_cache.pop(var, None)
+        else:
+            db_cache[var] = value
+    drop_policies(variables)
+
+
+class ChatPolicy:
+    """Moderation settings of one chat, compiled from the core.ats values"""
+
+    __slots__ = ("linked", "antich", "antiraid", "welcome")
+
+    def __init__(self, chat_id: int, settings: dict):
+        self.linked = settings.get(f"linked{chat_id}", 0)
+        self.antich = settings.get(f"antich{chat_id}", False)
+        self.antiraid = settings.get(f"antiraid{chat_id}", False)
+        self.welcome = (
+            settings.get(f"welcome_text{chat_id}")
+            if settings.get(f"welcome_enabled{chat_id}", False)
+            else None
+        )
+
+
+policies: dict = {}
+moderation = ActionQueue(workers=2)
+deleter = DeleteBatcher(moderation)
+history_tasks: set = set()
+
+
+def get_policy(chat_id: int) -> ChatPolicy:
+    refresh_cache()
+    policy = policies.get(chat_id)
+    if policy is None:
+        policy = policies[chat_id] = ChatPolicy(chat_id, db_cache)
+    return policy
+
+
+bus.subscribe("core.ats", on_ats_change)
 
 
 @Client.on_message(filters.group & ~filters.me)
-async def admintool_handler(_, message: Message):
-    if message.sender_chat and (
-        message.sender_chat.type == "supergroup"
-        or message.sender_chat.id == db_cache.get(f"linked{message.chat.id}", 0)
+async def admintool_handler(client: Client, message: Message):
+    chat_id = message.chat.id
+    policy = get_policy(chat_id)
+    sender_chat = message.sender_chat
+    if sender_chat and (
+        sender_chat.type == ChatType.SUPERGROUP or sender_chat.id == policy.linked
     ):
         raise ContinuePropagation
 
-    if message.sender_chat and db_cache.get(f"antich{message.chat.id}", False):
-        with suppress(RPCError):
-            await message.delete()
-            await message.chat.ban_member(message.sender_chat.id)
-
-    tmuted_users = db_cache.get(f"c{message.chat.id}", [])
-    if (
-        message.from_user
-        and message.from_user.id in tmuted_users
-        or message.sender_chat
-        and message.sender_chat.id in tmuted_users
-    ):
-        with suppress(RPCError):
-            await message.delete()
-
-    if db_cache.get(f"antiraid{message.chat.id}", False):
-        with suppress(RPCError):
-            await message.delete()
-            if message.from_user:
-                await message.chat.ban_member(message.from_user.id)
-            elif message.sender_chat:
-                await message.chat.ban_member(message.sender_chat.id)
-
-    if message.new_chat_members and db_cache.get(
-        f"welcome_enabled{message.chat.id}", False
-    ):
-        await message.reply(
-            db_cache.get(f"welcome_text{message.chat.id}"),
-            disable_web_page_preview=True,
-        )
+    sender_id = sender_chat.id if sender_chat else getattr(message.from_user, "id", None)
+    delete = tmutes.is_muted(chat_id, sender_id)
+    ban = None
+    if sender_chat and policy.antich or policy.antiraid:
+        delete = True
+        ban = sender_id
+
+    if delete:
+        deleter.delete(client, chat_id, message.id)
+    if ban:
+        moderation.submit(("ban", chat_id, ban), client.ban_chat_member, chat_id, ban)
+
+    if message.new_chat_members and policy.welcome is not None:
+        await message.reply(policy.welcome, disable_web_page_preview=True)
 
     raise ContinuePropagation
 
@@ -129,6 +190,12 @@ async def kick_command(client: Client, message: Message):
     await handler.handle_kick()
 
 
+@Client.on_message(filters.command(["bban", "bkick", "bmute"], prefix) & filters.me)
+async def bulk_moderation_command(client: Client, message: Message):
+    handler = BulkModerationHandler(client, message, message.command[0][1:])
+    await handler.handle()
+
+
 @Client.on_message(filters.command(["kickdel"], prefix) & filters.me)
 async def kickdel_cmd(client: Client, message: Message):
     handler = KickDeletedAccountsHandler(client, message)
@@ -139,14 +206,12 @@ async def kickdel_cmd(client: Client, message: Message):
 async def tmute_command(client: Client, message: Message):
     handler = TimeMuteHandler(client, message)
     await handler.handle_tmute()
-    update_cache()
 
 
 @Client.on_message(filters.command(["tunmute"], prefix) & filters.me)
 async def tunmute_command(client: Client, message: Message):
     handler = TimeUnmuteHandler(client, message)
     await handler.handle_tunmute()
-    update_cache()
 
 
 @Client.on_message(filters.command(["tmute_users"], prefix) & filters.me)
@@ -183,13 +248,15 @@ async def promote_command(client: Client, message: Message):
 async def anti_channels(client: Client, message: Message):
     handler = AntiChannelsHandler(client, message)
     await handler.handle_anti_channels()
-    update_cache()
 
 
 @Client.on_message(filters.command(["delete_history", "dh"], prefix))
 async def delete_history(client: Client, message: Message):
     handler = DeleteHistoryHandler(client, message)
-    await handler.handle_delete_history()
+    # large histories take a while, don't hold a dispatcher worker meanwhile
+    task = asyncio.create_task(handler.handle_delete_history())
+    history_tasks.add(task)
+    task.add_done_callback(history_tasks.discard)
 
 
 @Client.on_message(filters.command(["report_spam", "rs"], prefix))
@@ -304,7 +371,6 @@ async def unro(client: Client, message: Message):
 async def antiraid(client: Client, message: Message):
     handler = AntiRaidHandler(client, message)
     await handler.handle_antiraid()
-    update_cache()
 
 
 @Client.on_message(filters.command(["welcome", "wc"], prefix) & filters.me)
@@ -314,8 +380,13 @@ async def welcome(_, message: Message):
 
     if len(message.command) > 1:
         text = message.text.split(maxsplit=1)[1]
-        db.set("core.ats", f"welcome_enabled{message.chat.id}", True)
-        db.set("core.ats", f"welcome_text{message.chat.id}", text)
+        db.set_many(
+            "core.ats",
+            {
+                f"welcome_enabled{message.chat.id}": True,
+                f"welcome_text{message.chat.id}": text,
+            },
+        )
 
         await message.edit(
             f"<b>Welcome enabled in this chat\nText:</b> <code>{text}</code>"
@@ -324,7 +395,6 @@ async def welcome(_, message: Message):
         db.set("core.ats", f"welcome_enabled{message.chat.id}", False)
         await message.edit("<b>Welcome disabled in this chat</b>")
 
-    update_cache()
 
 
 modules_help["admintool"] = {
@@ -335,11 +405,16 @@ modules_help["admintool"] = {
     "unmute [reply]/[userid]* [reason]": "unmute user in chat",
     "promote [reply]/[userid]* [prefix]": "promote user in chat",
     "demote [reply]/[userid]* [reason]": "demote user in chat",
-    "tmute [reply]/[username/id]* [reason]": "delete all new messages from user in chat",
+    "bban [username/id ...] [--joined 10m]": "ban many users at once, listed "
+    "and/or everyone who joined in the given time",
+    "bkick [username/id ...] [--joined 10m]": "kick many users at once",
+    "bmute [username/id ...] [--joined 10m] [--for 1h]": "mute many users at once",
+    "tmute [reply]/[username/id]* [reason] [1m]/[1h]/[1d]/[1w]": "delete all new "
+    "messages from user in chat, forever or for the given time",
     "tunmute [reply]/[username/id]* [reason]": "stop deleting all messages from user in chat",
     "tmute_users": "list of tmuted (.tmute) users",
     "antich [enable/disable]": "turn on/off blocking channels in this chat",
-    "delete_history [reply]/[username/id]* [reason]": "delete history from member in chat",
+    "delete_history [reply]/[username/id,...]* [reason]": "delete history from members in chat",
     "report_spam [reply]*": "report spam message in chat",
     "pin [reply]*": "Pin replied message",
     "unpin [reply]*": "Unpin replied message",
@@ -349,5 +424,5 @@ modules_help["admintool"] = {
     "Running without arguments equals to toggling state",
     "welcome [text]*": "enable auto-welcome to new users in groups. "
     "Running without text equals to disable",
-    "kickdel": "Kick all deleted accounts",
+    "kickdel [restart]": "Kick all deleted accounts, resuming an interrupted sweep unless restart is given",
 }
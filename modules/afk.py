@@ -15,33 +15,148 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
+import time
 from datetime import datetime
 
 import humanize
 from pyrogram import Client, filters
 from pyrogram.types import Message
 
+from utils import config
 from utils.misc import modules_help, prefix
 from utils.scripts import ReplyCheck
 from utils.db import db
 
-# Variables
-AFK = False
-AFK_REASON = ""
-AFK_TIME = ""
-USERS = {}
-GROUPS = {}
 
+class AfkState:
+    """AFK status, per-chat message counters and reply deduplication.
+
+    Counters are kept in memory and snapshotted to the database every
+    ``AFK_SNAPSHOT_INTERVAL`` seconds while AFK, so a restart doesn't reset
+    them. A chat gets at most one automatic reply per ``AFK_REPLY_WINDOW``
+    seconds.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.reason = ""
+        self.since = None
+        self.counts = {}
+        self._replied = {}
+        self._dirty = False
+        self._task = None
+        self._template = db.get("core.afk", "afk_msg", None)
+        self._rendered = {}
+
+        state = db.get("core.afk", "state", None)
+        if state:
+            self.active = True
+            self.reason = state["reason"]
+            self.since = datetime.fromtimestamp(state["since"])
+            self.counts = {int(chat): count for chat, count in state["counts"].items()}
+
+    def start(self, reason: str):
+        self.active = True
+        self.reason = reason
+        self.since = datetime.now()
+        self.counts = {}
+        self._replied = {}
+        self._rendered = {}
+        self.snapshot(force=True)
+
+    def stop(self) -> tuple:
+        """Leave AFK, returns (away for, messages, chats)"""
+        summary = (self.last_seen(), sum(self.counts.values()), len(self.counts))
+        self.active = False
+        self.counts = {}
+        self._replied = {}
+        self._rendered = {}
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        db.remove("core.afk", "state")
+        return summary
+
+    def set_template(self, template: str):
+        self._template = template
+        self._rendered = {}
+
+    def last_seen(self) -> str:
+        return humanize.naturaldelta(datetime.now() - self.since)
+
+    def hit(self, chat_id: int) -> bool:
+        """Count a message, True if the chat is due an automatic reply"""
+        self.counts[chat_id] = self.counts.get(chat_id, 0) + 1
+        self._dirty = True
+        self._ensure_snapshots()
+        now = time.monotonic()
+        last = self._replied.get(chat_id)
+        if last is not None and now - last < config.afk_reply_window:
+            return False
+        self._replied[chat_id] = now
+        return True
+
+    def render(self, first: bool) -> str:
+        """Reply text, rendered again only when the minute changes"""
+        minute = int((datetime.now() - self.since).total_seconds() // 60)
+        key = (first, minute)
+        if key not in self._rendered:
+            self._rendered = {k: v for k, v in self._rendered.items() if k[1] == minute}
+            self._rendered[key] = self._render(first)
+        return self._rendered[key]
+
+    def _render(self, first: bool) -> str:
+        last_seen = self.last_seen()
+        if not first:
+            return (
+                f"<b>Hey I'm still not back yet.\n"
+                f"Last seen: {last_seen} ago\n"
+                f"Still busy: <code>{self.reason.upper()}</code>\n"
+                f"Try pinging a bit later.</b>"
+            )
+        if self._template is None:
+            return (
+                f"<b>Beep boop. This is an automated message.\n"
+                f"I am not available right now.\n"
+                f"Last seen: {last_seen} ago\n"
+                f"Reason: <code>{self.reason.upper()}</code>\n"
+                f"See you after I'm done doing whatever I'm doing.</b>"
+            )
+        return self._template.format(last_seen=last_seen, reason=self.reason)
+
+    def snapshot(self, force: bool = False):
+        if not self.active or not (self._dirty or force):
+            return
+        db.set(
+            "core.afk",
+            "state",
+            {
+                "reason": self.reason,
+                "since": self.since.timestamp(),
+                "counts": {str(chat): count for chat, count in self.counts.items()},
+            },
+        )
+        self._dirty = False
 
-def GetChatID(message: Message):
-    """Get the group id of the incoming message"""
-    return message.chat.id
+    def _ensure_snapshots(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._snapshots())
 
+    async def _snapshots(self):
+        while True:
+            await asyncio.sleep(config.afk_snapshot_interval)
+            self.snapshot()
 
-def subtract_time(start, end):
-    """Get humanized time"""
-    subtracted = humanize.naturaltime(start - end)
-    return str(subtracted)
+
+afk = AfkState()
+
+
+def away_summary() -> str:
+    last_seen, messages, chats = afk.stop()
+    return (
+        f"<code>While you were away (for {last_seen}), you received {messages} "
+        f"messages from {chats} chats</code>"
+    )
 
 
 # Main
@@ -54,97 +169,29 @@ def subtract_time(start, end):
     group=3,
 )
 async def collect_afk_messages(bot: Client, message: Message):
-    if AFK:
-        last_seen = subtract_time(datetime.now(), AFK_TIME)
-        is_group = message.chat.type in ["supergroup", "group"]
-        CHAT_TYPE = GROUPS if is_group else USERS
-
-        if GetChatID(message) not in CHAT_TYPE:
-            text = db.get("core.afk", "afk_msg", None)
-            if text is None:
-                text = (
-                    f"<b>Beep boop. This is an automated message.\n"
-                    f"I am not available right now.\n"
-                    f"Last seen: {last_seen}\n"
-                    f"Reason: <code>{AFK_REASON.upper()}</code>\n"
-                    f"See you after I'm done doing whatever I'm doing.</b>"
-                )
-            else:
-                last_seen = last_seen.replace("ago", "").strip()
-                text = text.format(last_seen=last_seen, reason=AFK_REASON)
-            await bot.send_message(
-                chat_id=GetChatID(message),
-                text=text,
-                reply_to_message_id=ReplyCheck(message),
-            )
-            CHAT_TYPE[GetChatID(message)] = 1
-            return
-        if GetChatID(message) in CHAT_TYPE:
-            if CHAT_TYPE[GetChatID(message)] == 50:
-                text = (
-                    f"<b>This is an automated message\n"
-                    f"Last seen: {last_seen}\n"
-                    f"This is the 10th time I've told you I'm AFK right now...\n"
-                    f"I'll get to you when I get to you.\n"
-                    f"No more auto messages for you</b>"
-                )
-                await bot.send_message(
-                    chat_id=GetChatID(message),
-                    text=text,
-                    reply_to_message_id=ReplyCheck(message),
-                )
-            elif CHAT_TYPE[GetChatID(message)] > 50:
-                return
-            elif CHAT_TYPE[GetChatID(message)] % 5 == 0:
-                text = (
-                    f"<b>Hey I'm still not back yet.\n"
-                    f"Last seen: {last_seen}\n"
-                    f"Still busy: <code>{AFK_REASON.upper()}</code>\n"
-                    f"Try pinging a bit later.</b>"
-                )
-                await bot.send_message(
-                    chat_id=GetChatID(message),
-                    text=text,
-                    reply_to_message_id=ReplyCheck(message),
-                )
-
-        CHAT_TYPE[GetChatID(message)] += 1
+    if not afk.active:
+        return
+    chat_id = message.chat.id
+    first = chat_id not in afk.counts
+    if afk.hit(chat_id):
+        await bot.send_message(
+            chat_id=chat_id,
+            text=afk.render(first),
+            reply_to_message_id=ReplyCheck(message),
+        )
 
 
 @Client.on_message(filters.command("afk", prefix) & filters.me, group=3)
 async def afk_set(_, message: Message):
-    global AFK_REASON, AFK, AFK_TIME
-
     cmd = message.command
-    afk_text = ""
-
-    if len(cmd) > 1:
-        afk_text = " ".join(cmd[1:])
-
-    if isinstance(afk_text, str):
-        AFK_REASON = afk_text
-
-    AFK = True
-    AFK_TIME = datetime.now()
-
+    afk.start(" ".join(cmd[1:]) if len(cmd) > 1 else "")
     await message.delete()
 
 
 @Client.on_message(filters.command("afk", "!") & filters.me, group=3)
 async def afk_unset(_, message: Message):
-    global AFK, AFK_TIME, AFK_REASON, USERS, GROUPS
-
-    if AFK:
-        last_seen = subtract_time(datetime.now(), AFK_TIME).replace("ago", "").strip()
-        await message.edit(
-            f"<code>While you were away (for {last_seen}), you received {sum(USERS.values()) + sum(GROUPS.values())} "
-            f"messages from {len(USERS) + len(GROUPS)} chats</code>",
-        )
-        AFK = False
-        AFK_TIME = ""
-        AFK_REASON = ""
-        USERS = {}
-        GROUPS = {}
+    if afk.active:
+        await message.edit(away_summary())
         await asyncio.sleep(5)
 
     await message.delete()
@@ -176,28 +223,15 @@ async def set_afk_msg(_, message: Message):
             "AFK message should contain <code>{last_seen}</code> to indicate where the last seen time will be placed."
         )
 
-    old_afk_msg = db.get("core.afk", "afk_msg", None)
-    if old_afk_msg:
-        db.remove("core.afk", "afk_msg")
     db.set("core.afk", "afk_msg", afk_msg)
+    afk.set_template(afk_msg)
     await message.edit(f"AFK message set to:\n\n{afk_msg}")
 
 
 @Client.on_message(filters.me, group=3)
 async def auto_afk_unset(_, message: Message):
-    global AFK, AFK_TIME, AFK_REASON, USERS, GROUPS
-
-    if AFK:
-        last_seen = subtract_time(datetime.now(), AFK_TIME).replace("ago", "").strip()
-        reply = await message.reply(
-            f"<code>While you were away (for {last_seen}), you received {sum(USERS.values()) + sum(GROUPS.values())} "
-            f"messages from {len(USERS) + len(GROUPS)} chats</code>"
-        )
-        AFK = False
-        AFK_TIME = ""
-        AFK_REASON = ""
-        USERS = {}
-        GROUPS = {}
+    if afk.active:
+        reply = await message.reply(away_summary())
         await asyncio.sleep(5)
         await reply.delete()
 
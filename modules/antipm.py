@@ -20,19 +20,52 @@ from pyrogram import Client, filters
 from pyrogram.raw import functions
 from pyrogram.types import Message
 
+from utils import config
+from utils.actions import ActionQueue
 from utils.config import pm_limit
 from utils.db import db
 from utils.misc import modules_help, prefix
+from utils.ledger import WarningLedger
+from utils.peers import peers
+
+
+async def anti_pm_status(_, __, ___):
+    return await db.aget("core.antipm", "status", False)
 
-anti_pm_enabled = filters.create(
-    lambda _, __, ___: db.get("core.antipm", "status", False)
-)
+
+anti_pm_enabled = filters.create(anti_pm_status)
 
 in_contact_list = filters.create(lambda _, __, message: message.from_user.is_contact)
 
 is_support = filters.create(lambda _, __, message: message.chat.is_support)
 
-USER_WARNINGS = {}
+warning_ledger = WarningLedger(
+    "core.antipm",
+    max_size=config.antipm_ledger_size,
+    ttl=config.antipm_warning_ttl,
+)
+actions = ActionQueue(workers=2)
+
+
+async def report_spam(client: Client, chat_id: int):
+    peer = await peers.resolve_peer(client, chat_id)
+    await client.invoke(functions.messages.ReportSpam(peer=peer))
+
+
+async def send_warning(client: Client, chat_id: int, text: str):
+    default_pic = await db.aget("core.antipm", "antipm_pic", None)
+    if default_pic and os.path.exists(default_pic):
+        await client.send_photo(chat_id, default_pic, caption=text)
+    else:
+        await client.send_message(chat_id, text)
+
+
+async def last_warning(client: Client, chat_id: int, user_id: int):
+    await client.send_message(
+        chat_id,
+        "<b>Ehm...! That was your Last warn, Bye Bye see you L0L</b>",
+    )
+    await client.block_user(user_id)
 
 
 @Client.on_message(
@@ -46,11 +79,17 @@ USER_WARNINGS = {}
 async def anti_pm_handler(client: Client, message: Message):
     user_id = message.from_user.id
     ids = message.chat.id
-    b_f = await client.get_me()
-    u_n = b_f.first_name
-    user = await client.get_users(ids)
-    u_f = user.first_name
-    default_text = db.get("core.antipm", "antipm_msg", None)
+    u_n = (await peers.get_me(client)).first_name
+    # in a private chat the sender is the chat partner, no need to fetch it
+    peers.remember(message.from_user)
+    u_f = message.from_user.first_name
+    if actions.pending(("block", user_id)):
+        return
+    settings = await db.aget_many(
+        "core.antipm",
+        ["antipm_msg", "spamrep", "block", f"disallowusers{ids}", f"allowusers{ids}"],
+    )
+    default_text = settings["antipm_msg"]
     if default_text is None:
         default_text = f"""<b>Hello, {u_f}!
 This is the Assistant Of {u_n}.</b>
@@ -58,43 +97,27 @@ This is the Assistant Of {u_n}.</b>
 Do not spam further messages else I may have to block you!</i>
 
 <b>This is an automated message by the assistant.</b>
-<b><u>Currently You Have <code>{USER_WARNINGS.get(user_id, 0)}</code> Warnings.</u></b>
+<b><u>Currently You Have <code>{warning_ledger.get(user_id)}</code> Warnings.</u></b>
     """
     else:
         default_text = default_text.format(
-            user=u_f, my_name=u_n, warns=USER_WARNINGS.get(user_id, 0)
+            user=u_f, my_name=u_n, warns=warning_ledger.get(user_id)
         )
 
-    if db.get("core.antipm", "spamrep", False):
-        user_info = await client.resolve_peer(ids)
-        await client.invoke(functions.messages.ReportSpam(peer=user_info))
-
-    if db.get("core.antipm", "block", False):
-        await client.block_user(user_id)
-
-    if db.get("core.antipm", f"disallowusers{ids}") == user_id != db.get(
-        "core.antipm", f"allowusers{ids}"
-    ) or db.get("core.antipm", f"disallowusers{ids}") != user_id != db.get(
-        "core.antipm", f"allowusers{ids}"
-    ):
-        default_pic = db.get("core.antipm", "antipm_pic", None)
-        if default_pic and os.path.exists(default_pic):
-            await client.send_photo(message.chat.id, default_pic, caption=default_text)
-        else:
-            await client.send_message(message.chat.id, default_text)
+    if settings["spamrep"]:
+        actions.submit(("report", user_id), report_spam, client, ids)
 
-        if user_id in USER_WARNINGS:
-            USER_WARNINGS[user_id] += 1
-        else:
-            USER_WARNINGS[user_id] = 1
+    if settings["block"]:
+        actions.submit(("block", user_id), client.block_user, user_id)
 
-        if USER_WARNINGS[user_id] > pm_limit:
-            await client.send_message(
-                message.chat.id,
-                "<b>Ehm...! That was your Last warn, Bye Bye see you L0L</b>",
-            )
-            await client.block_user(user_id)
-            del USER_WARNINGS[user_id]
+    disallowed = settings[f"disallowusers{ids}"]
+    allowed = settings[f"allowusers{ids}"]
+    if disallowed == user_id != allowed or disallowed != user_id != allowed:
+        if warning_ledger.warn(user_id) > pm_limit:
+            actions.submit(("block", user_id), last_warning, client, ids, user_id)
+            warning_ledger.reset(user_id)
+        else:
+            actions.submit(("warn", user_id), send_warning, client, ids, default_text)
 
 
 @Client.on_message(filters.command(["antipm", "anti_pm"], prefix) & filters.me)
@@ -171,8 +194,7 @@ async def add_contact(_, message: Message):
     ids = message.chat.id
 
     db.set("core.antipm", f"allowusers{ids}", ids)
-    if ids in USER_WARNINGS:
-        del USER_WARNINGS[ids]
+    warning_ledger.reset(ids)
     await message.edit("User Approved!")
 
 
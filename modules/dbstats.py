@@ -0,0 +1,107 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+
+from pyrogram import Client, filters
+from pyrogram.types import Message
+
+from utils import config
+from utils.db import (
+    CachedDatabase,
+    db,
+    index_usage,
+    mongo_health,
+    mongo_pool_info,
+)
+from utils.mongo_logger import get_log_collection
+from utils.misc import modules_help, prefix
+from utils.scripts import format_exc
+
+
+@Client.on_message(filters.command(["dbstats"], prefix) & filters.me)
+async def dbstats(_, message: Message):
+    try:
+        text = f"<b>Database:</b> <code>{config.db_type}</code>\n"
+
+        if isinstance(db, CachedDatabase):
+            hits = sum(c["hits"] for c in db.stats.values())
+            misses = sum(c["misses"] for c in db.stats.values())
+            ratio = hits / (hits + misses) * 100 if hits + misses else 0
+            text += (
+                f"\n<b>Cache:</b> {hits} hits, {misses} misses "
+                f"(<code>{ratio:.1f}%</code>)\n"
+            )
+            busiest = sorted(
+                db.stats.items(),
+                key=lambda item: item[1]["hits"] + item[1]["misses"],
+                reverse=True,
+            )[:10]
+            for module, counters in busiest:
+                text += (
+                    f"• <code>{module}</code>: "
+                    f"{counters['hits']}/{counters['misses']}\n"
+                )
+
+        if config.db_type in ["mongo", "mongodb"]:
+            health = await asyncio.to_thread(mongo_health)
+            if health["ok"]:
+                text += f"\n<b>Mongo:</b> ok, ping {health['latency_ms']}ms\n"
+            else:
+                text += f"\n<b>Mongo:</b> <code>{health['error']}</code>\n"
+            text += "".join(
+                f"• {key}: <code>{value}</code>\n"
+                for key, value in mongo_pool_info().items()
+            )
+
+        await message.edit(text)
+    except Exception as e:
+        await message.edit(format_exc(e))
+
+
+def _format_index_stats(title: str, stats: list) -> str:
+    text = f"\n<b>{title}</b>\n"
+    for name, keys, ops, since in stats:
+        text += f"• <code>{name}</code> ({keys}): {ops} ops since {since:%Y-%m-%d}\n"
+    return text
+
+
+def _collect_index_stats(module: str = None) -> str:
+    backend = db.backend if isinstance(db, CachedDatabase) else db
+    text = ""
+    if config.db_type in ["mongo", "mongodb"]:
+        modules = [module] if module else backend._database.list_collection_names()
+        for name in sorted(modules):
+            text += _format_index_stats(name, backend.index_stats(name))
+    if not module and config.log_mongo_uri:
+        text += _format_index_stats("message log", index_usage(get_log_collection()))
+    return text
+
+
+@Client.on_message(filters.command(["dbindexes"], prefix) & filters.me)
+async def dbindexes(_, message: Message):
+    module = message.command[1] if len(message.command) > 1 else None
+    try:
+        text = await asyncio.to_thread(_collect_index_stats, module)
+        await message.edit(text or "<b>No Mongo collections to report on</b>")
+    except Exception as e:
+        await message.edit(format_exc(e))
+
+
+modules_help["dbstats"] = {
+    "dbstats": "Show database cache hit rates and Mongo connection pool status",
+    "dbindexes [module]": "Show index usage counters of Mongo collections",
+}
@@ -14,18 +14,19 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import re
+
 from pyrogram import Client, ContinuePropagation, errors, filters
-from pyrogram.types import (
-    InputMediaAudio,
-    InputMediaDocument,
-    InputMediaPhoto,
-    InputMediaVideo,
-    Message,
-)
+from pyrogram.types import Message
 
+from utils import config
+from utils.actions import ActionQueue
 from utils.db import db
 from utils.misc import modules_help, prefix
+from utils.ratelimit import RateLimiter
+from utils.reply_cache import reply_cache
 from utils.scripts import format_exc
+from utils.triggers import MODES, PATTERN_MODES, TriggerCache, compile_trigger
 
 
 def get_filters_chat(chat_id):
@@ -36,93 +37,74 @@ def set_filters_chat(chat_id, filters_):
     return db.set("core.filters", f"{chat_id}", filters_)
 
 
+async def aget_filters_chat(chat_id):
+    return await db.aget("core.filters", f"{chat_id}", {})
+
+
+trigger_cache = TriggerCache(aget_filters_chat, timeout=config.filter_regex_timeout)
+reply_limiter = RateLimiter(
+    config.filter_chat_rate,
+    config.filter_chat_burst,
+    config.filter_trigger_rate,
+    config.filter_trigger_burst,
+    window=config.filter_coalesce_window,
+)
+replies = ActionQueue(workers=4)
+
+
 async def contains_filter(_, __, m):
-    return m.text and m.text.lower() in get_filters_chat(m.chat.id).keys()
+    if not m.text:
+        return False
+    found = await trigger_cache.match(m.chat.id, m.text)
+    if found is None:
+        return False
+    m.filter_trigger, m.filter_value = found
+    return True
 
 
 contains = filters.create(contains_filter)
 
 
+def parse_mode(text: str) -> tuple:
+    """Split an optional mode flag (--prefix, --regex...) off the command arguments"""
+    args = text.split(maxsplit=2)[1:]
+    if args and args[0].startswith("--") and args[0][2:] in MODES:
+        return args[0][2:], args[1] if len(args) > 1 else ""
+    return "exact", text.split(maxsplit=1)[1] if args else ""
+
+
+def find_filter(chat_filters: dict, name: str) -> str | None:
+    """Key of a filter by name, regex triggers keep their case"""
+    for key in (name, name.lower()):
+        if key in chat_filters:
+            return key
+    return None
+
+
+async def send_filter_reply(client: Client, chat_id: int, value: dict, message_id: int):
+    try:
+        await reply_cache.send(client, chat_id, value, reply_to_message_id=message_id)
+    except errors.FloodWait as exc:
+        # longer than the client's sleep_threshold, stay quiet in this chat
+        reply_limiter.block(chat_id, exc.value)
+    except ValueError:
+        pass
+
+
 # noinspection PyTypeChecker
 @Client.on_message(contains)
 async def filters_main_handler(client: Client, message: Message):
-    value = get_filters_chat(message.chat.id)[message.text.lower()]
-    try:
-        await client.get_messages(int(value["CHAT_ID"]), int(value["MESSAGE_ID"]))
-    except errors.RPCError as exc:
-        raise ContinuePropagation from exc
-
-    if value.get("MEDIA_GROUP"):
-        messages_grouped = await client.get_media_group(
-            int(value["CHAT_ID"]), int(value["MESSAGE_ID"])
-        )
-        media_grouped_list = []
-        for _ in messages_grouped:
-            if _.photo:
-                if _.caption:
-                    media_grouped_list.append(
-                        InputMediaPhoto(_.photo.file_id, _.caption.HTML)
-                    )
-                else:
-                    media_grouped_list.append(InputMediaPhoto(_.photo.file_id))
-            elif _.video:
-                if _.caption:
-                    if _.video.thumbs:
-                        media_grouped_list.append(
-                            InputMediaVideo(
-                                _.video.file_id,
-                                _.video.thumbs[0].file_id,
-                                _.caption.HTML,
-                            )
-                        )
-                    else:
-                        media_grouped_list.append(
-                            InputMediaVideo(_.video.file_id, _.caption.HTML)
-                        )
-                elif _.video.thumbs:
-                    media_grouped_list.append(
-                        InputMediaVideo(_.video.file_id, _.video.thumbs[0].file_id)
-                    )
-                else:
-                    media_grouped_list.append(InputMediaVideo(_.video.file_id))
-            elif _.audio:
-                if _.caption:
-                    media_grouped_list.append(
-                        InputMediaAudio(_.audio.file_id, _.caption.HTML)
-                    )
-                else:
-                    media_grouped_list.append(InputMediaAudio(_.audio.file_id))
-            elif _.document:
-                if _.caption:
-                    if _.document.thumbs:
-                        media_grouped_list.append(
-                            InputMediaDocument(
-                                _.document.file_id,
-                                _.document.thumbs[0].file_id,
-                                _.caption.HTML,
-                            )
-                        )
-                    else:
-                        media_grouped_list.append(
-                            InputMediaDocument(_.document.file_id, _.caption.HTML)
-                        )
-                elif _.document.thumbs:
-                    media_grouped_list.append(
-                        InputMediaDocument(
-                            _.document.file_id, _.document.thumbs[0].file_id
-                        )
-                    )
-                else:
-                    media_grouped_list.append(InputMediaDocument(_.document.file_id))
-        await client.send_media_group(
-            message.chat.id, media_grouped_list, reply_to_message_id=message.id
-        )
-    else:
-        await client.copy_message(
+    if reply_limiter.allow(message.chat.id, message.filter_trigger):
+        # Replies are sent off the dispatcher: pyrogram sleeps through short
+        # FloodWaits inside the send, and while a reply to a chat is pending
+        # further replies to it are dropped rather than queued behind it.
+        replies.submit(
+            ("reply", message.chat.id),
+            send_filter_reply,
+            client,
             message.chat.id,
-            int(value["CHAT_ID"]),
-            int(value["MESSAGE_ID"]),
-            reply_to_message_id=message.id,
+            message.filter_value,
+            message.id,
         )
     raise ContinuePropagation
 
@@ -130,11 +112,21 @@ async def filters_main_handler(client: Client, message: Message):
 @Client.on_message(filters.command(["filter"], prefix) & filters.me)
 async def filter_handler(client: Client, message: Message):
     try:
-        if len(message.text.split()) < 2:
+        mode, name = parse_mode(message.text)
+        if not name:
             return await message.edit(
-                f"<b>Usage</b>: <code>{prefix}filter [name] (Reply required)</code>"
+                f"<b>Usage</b>: <code>{prefix}filter "
+                "[--prefix/--contains/--regex/--glob] [name] (Reply required)</code>"
             )
-        name = message.text.split(maxsplit=1)[1].lower()
+        if mode != "regex":
+            name = name.lower()
+        if mode in PATTERN_MODES:
+            try:
+                compile_trigger(name, mode)
+            except re.error as e:
+                return await message.edit(
+                    f"<b>Invalid pattern</b> <code>{name}</code>: <code>{e}</code>"
+                )
         chat_filters = get_filters_chat(message.chat.id)
         if name in chat_filters.keys():
             return await message.edit(
@@ -174,7 +166,9 @@ async def filter_handler(client: Client, message: Message):
                 "MESSAGE_ID": str(message_id[1].id),
                 "MEDIA_GROUP": True,
                 "CHAT_ID": str(chat_id),
+                "MODE": mode,
             }
+            reply_cache.store(chat_id, message_id[1].id, message_id)
         else:
             try:
                 message_id = await message.reply_to_message.forward(chat_id)
@@ -184,11 +178,13 @@ async def filter_handler(client: Client, message: Message):
                 "MEDIA_GROUP": False,
                 "MESSAGE_ID": str(message_id.id),
                 "CHAT_ID": str(chat_id),
+                "MODE": mode,
             }
 
         chat_filters.update({name: filter_})
 
         set_filters_chat(message.chat.id, chat_filters)
+        trigger_cache.invalidate(message.chat.id)
         return await message.edit(
             f"<b>Filter</b> <code>{name}</code> has been added.",
         )
@@ -200,10 +196,15 @@ async def filter_handler(client: Client, message: Message):
 async def filters_handler(_, message: Message):
     try:
         text = ""
+        hits = trigger_cache.hits.get(message.chat.id, {})
         for index, a in enumerate(get_filters_chat(message.chat.id).items(), start=1):
-            key, _ = a
+            key, value = a
+            count = hits.get(key, 0)
             key = key.replace("<", "").replace(">", "")
-            text += f"{index}. <code>{key}</code>\n"
+            mode = value.get("MODE", "exact")
+            text += f"{index}. <code>{key}</code>"
+            text += f" ({mode})" if mode != "exact" else ""
+            text += f" — {count} hits\n" if count else "\n"
         text = f"<b>Your filters in current chat</b>:\n\n" f"{text}"
         text = text[:4096]
         return await message.edit(text)
@@ -220,14 +221,20 @@ async def filter_del_handler(_, message: Message):
             return await message.edit(
                 f"<b>Usage</b>: <code>{prefix}fdel [name]</code>",
             )
-        name = message.text.split(maxsplit=1)[1].lower()
         chat_filters = get_filters_chat(message.chat.id)
-        if name not in chat_filters.keys():
+        name = find_filter(chat_filters, message.text.split(maxsplit=1)[1])
+        if name is None:
             return await message.edit(
-                f"<b>Filter</b> <code>{name}</code> doesn't exists.",
+                f"<b>Filter</b> <code>{message.text.split(maxsplit=1)[1]}</code> "
+                "doesn't exists.",
+            )
+        if chat_filters[name].get("MEDIA_GROUP"):
+            reply_cache.forget(
+                chat_filters[name]["CHAT_ID"], chat_filters[name]["MESSAGE_ID"]
             )
         del chat_filters[name]
         set_filters_chat(message.chat.id, chat_filters)
+        trigger_cache.invalidate(message.chat.id)
         return await message.edit(
             f"<b>Filter</b> <code>{name}</code> has been deleted.",
         )
@@ -242,11 +249,12 @@ async def filter_search_handler(_, message: Message):
             return await message.edit(
                 f"<b>Usage</b>: <code>{prefix}fsearch [name]</code>",
             )
-        name = message.text.split(maxsplit=1)[1].lower()
         chat_filters = get_filters_chat(message.chat.id)
-        if name not in chat_filters.keys():
+        name = find_filter(chat_filters, message.text.split(maxsplit=1)[1])
+        if name is None:
             return await message.edit(
-                f"<b>Filter</b> <code>{name}</code> doesn't exists.",
+                f"<b>Filter</b> <code>{message.text.split(maxsplit=1)[1]}</code> "
+                "doesn't exists.",
             )
         return await message.edit(
             f"<b>Trigger</b>:\n<code>{name}</code"
@@ -257,8 +265,12 @@ async def filter_search_handler(_, message: Message):
 
 
 modules_help["filters"] = {
-    "filter [name]": "Create filter (Reply required)",
-    "filters": "List of all triggers",
+    "filter [--prefix/--contains/--regex/--glob] [name]": "Create filter "
+    "(Reply required). By default the whole message must match, --prefix matches "
+    "messages starting with the name, --contains matches it anywhere in the "
+    "message, --regex searches a regular expression and --glob matches the whole "
+    "message against a wildcard pattern (* and ?)",
+    "filters": "List of all triggers with their hit counts",
     "fdel [name]": "Delete filter by name",
     "fsearch [name]": "Info filter by name",
 }
@@ -20,6 +20,7 @@ from pyrogram.types import Message
 from utils.db import db
 from utils.handlers import NoteSendHandler
 from utils.misc import modules_help, prefix
+from utils.reply_cache import reply_cache
 
 
 @Client.on_message(filters.command(["save"], prefix) & filters.me)
@@ -63,6 +64,7 @@ async def save_note(client: Client, message: Message):
                     "CHAT_ID": str(chat_id),
                 }
                 db.set("core.notes", f"note{note_name}", note)
+                reply_cache.store(chat_id, message_id[1].id, message_id)
                 await message.edit(f"<b>Note {note_name} saved</b>")
             else:
                 await message.edit("<b>This note already exists</b>")
@@ -114,10 +116,8 @@ async def note_send(client: Client, message: Message):
 async def notes(_, message: Message):
     await message.edit("<b>Loading...</b>")
     text = "Available notes:\n\n"
-    collection = db.get_collection("core.notes")
-    for note in collection.keys():
-        if note[:4] == "note":
-            text += f"<code>{note[4:]}</code>\n"
+    for note in db.get_prefix("core.notes", "note"):
+        text += f"<code>{note[4:]}</code>\n"
     await message.edit(text)
 
 
@@ -127,6 +127,8 @@ async def clear_note(_, message: Message):
         note_name = message.text.split(maxsplit=1)[1]
         find_note = db.get("core.notes", f"note{note_name}", False)
         if find_note:
+            if find_note.get("MEDIA_GROUP"):
+                reply_cache.forget(find_note["CHAT_ID"], find_note["MESSAGE_ID"])
             db.remove("core.notes", f"note{note_name}")
             await message.edit(f"<b>Note {note_name} deleted</b>")
         else:
@@ -15,11 +15,19 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
+import time
+from datetime import datetime, timedelta
+
 from pyrogram import Client, filters
+from pyrogram.enums import ChatType, MessagesFilter
+from pyrogram.raw import functions, types
 from pyrogram.types import Message
 
+from utils import config
+from utils.actions import BulkExecutor
+from utils.handlers import parse_duration
 from utils.misc import modules_help, prefix
-from utils.scripts import with_reply
+from utils.scripts import format_exc, with_reply
 
 
 @Client.on_message(filters.command("del", prefix) & filters.me)
@@ -28,27 +36,182 @@ async def del_msg(_, message: Message):
     await message.reply_to_message.delete()
 
 
+MEDIA_FILTERS = {
+    "photo": MessagesFilter.PHOTO,
+    "video": MessagesFilter.VIDEO,
+    "photo_video": MessagesFilter.PHOTO_VIDEO,
+    "document": MessagesFilter.DOCUMENT,
+    "audio": MessagesFilter.AUDIO,
+    "voice": MessagesFilter.VOICE_NOTE,
+    "round": MessagesFilter.VIDEO_NOTE,
+    "gif": MessagesFilter.ANIMATION,
+    "url": MessagesFilter.URL,
+}
+
+
+def parse_date(value: str) -> datetime:
+    """``YYYY-MM-DD[THH:MM]`` or a 1m/1h/1d/1w duration ago"""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        seconds = parse_duration(value)
+        if not seconds:
+            raise
+        return datetime.now() - timedelta(seconds=seconds)
+
+
+class Purge:
+    """Deletes the messages between two ids, optionally filtered.
+
+    Without filters in supergroups and channels, whose message ids are per
+    chat, the ids are computed from the range without reading the history.
+    Otherwise messages are read newest first, through ``search_messages``
+    when a sender or media type narrows it down server side. Ids are
+    grouped in chunks of 100 and deleted by a :class:`BulkExecutor` while
+    the next chunk is read. Deletions are sent with ``sleep_threshold=0``
+    so every FloodWait reaches the executor, which pauses and slows down,
+    instead of a fixed sleep. A dry run only reads and counts.
+    """
+
+    def __init__(self, client: Client, chat, first_id: int, last_id: int):
+        self.client = client
+        self.chat = chat
+        self.first_id = first_id
+        self.last_id = last_id
+        self.from_user = None
+        self.media = None
+        self.after = None
+        self.before = None
+        self.dry_run = False
+        self.matched = 0
+        self.deleted = 0
+        self.peer = None
+
+    def parse_args(self, args: list):
+        args = iter(args)
+        for arg in args:
+            if arg == "--from":
+                self.from_user = next(args)
+            elif arg == "--media":
+                self.media = MEDIA_FILTERS[next(args).lower()]
+            elif arg == "--after":
+                self.after = parse_date(next(args))
+            elif arg == "--before":
+                self.before = parse_date(next(args))
+            elif arg == "--dry":
+                self.dry_run = True
+            else:
+                raise ValueError(f"Unknown argument: {arg}")
+
+    @property
+    def filtered(self) -> bool:
+        return bool(self.from_user or self.media or self.after or self.before)
+
+    def messages(self):
+        if self.from_user or self.media:
+            return self.client.search_messages(
+                self.chat.id,
+                filter=self.media or MessagesFilter.EMPTY,
+                from_user=self.from_user,
+            )
+        return self.client.get_chat_history(self.chat.id, offset_id=self.last_id + 1)
+
+    async def message_ids(self):
+        """Ids to delete, newest first"""
+        if not self.filtered and not self.dry_run and self.chat.type in [
+            ChatType.SUPERGROUP,
+            ChatType.CHANNEL,
+        ]:
+            for message_id in range(self.last_id, self.first_id - 1, -1):
+                yield message_id
+            return
+        async for msg in self.messages():
+            if msg.id > self.last_id:
+                continue
+            if msg.id < self.first_id or (self.after and msg.date < self.after):
+                break
+            if self.before and msg.date >= self.before:
+                continue
+            yield msg.id
+
+    async def chunks(self):
+        chunk = []
+        async for message_id in self.message_ids():
+            self.matched += 1
+            chunk.append(message_id)
+            if len(chunk) >= 100:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def delete(self, chunk: list):
+        if isinstance(self.peer, types.InputPeerChannel):
+            query = functions.channels.DeleteMessages(channel=self.peer, id=chunk)
+        else:
+            query = functions.messages.DeleteMessages(id=chunk, revoke=True)
+        affected = await self.client.invoke(query, sleep_threshold=0)
+        self.deleted += affected.pts_count
+
+    async def count(self) -> dict:
+        started = time.monotonic()
+        summary = {"done": 0, "failed": 0, "errors": {}}
+        try:
+            async for _ in self.message_ids():
+                self.matched += 1
+        except Exception as e:
+            summary["error"] = e
+        summary["elapsed"] = time.monotonic() - started
+        return summary
+
+    async def run(self) -> dict:
+        if self.dry_run:
+            return await self.count()
+        self.peer = await self.client.resolve_peer(self.chat.id)
+        return await BulkExecutor(config.bulk_concurrency).stream(
+            self.chunks(), self.delete
+        )
+
+
 @Client.on_message(filters.command("purge", prefix) & filters.me)
 @with_reply
 async def purge(client: Client, message: Message):
-    chunk = []
-    async for msg in client.get_chat_history(
-        chat_id=message.chat.id,
-        limit=message.id - message.reply_to_message.id + 1,
-    ):
-        if msg.id < message.reply_to_message.id:
-            break
-        chunk.append(msg.id)
-        if len(chunk) >= 100:
-            await client.delete_messages(message.chat.id, chunk)
-            chunk.clear()
-            await asyncio.sleep(1)
-
-    if len(chunk) > 0:
-        await client.delete_messages(message.chat.id, chunk)
+    engine = Purge(client, message.chat, message.reply_to_message.id, message.id - 1)
+    try:
+        engine.parse_args(message.command[1:])
+    except (StopIteration, KeyError, ValueError):
+        return await message.edit(
+            f"<b>Usage:</b> <code>{prefix}purge [--from user] "
+            f"[--media {'|'.join(MEDIA_FILTERS)}] [--after date/1d] "
+            "[--before date/1h] [--dry]</code>"
+        )
+
+    summary = await engine.run()
+    if "error" in summary:
+        return await message.edit(format_exc(summary["error"]))
+    elapsed = max(summary["elapsed"], 0.001)
+    if engine.dry_run:
+        await message.edit(
+            f"<b>{engine.matched} messages would be deleted</b> "
+            f"<code>(counted in {elapsed:.1f}s)</code>"
+        )
+        return
+    text = (
+        f"<b>Purged {engine.deleted} messages in</b> <code>{elapsed:.1f}s</code> "
+        f"<code>({engine.deleted / elapsed:.0f} msg/s)</code>"
+    )
+    if summary["failed"]:
+        text += f"\n<b>{summary['failed']} chunks failed:</b> " + ", ".join(
+            f"<code>{name}</code>" for name in summary["errors"]
+        )
+    await message.edit(text)
+    await asyncio.sleep(5)
+    await message.delete()
 
 
 modules_help["purge"] = {
     "purge [reply]": "Purge (delete all messages) chat from replied message to last",
+    "purge [reply] [--from user] [--media type] [--after date/1d] [--before date/1h]": "Purge only matching messages, dates are YYYY-MM-DD or how long ago",
+    "purge [reply] --dry": "Count the messages purge would delete",
     "del [reply]": "Delete replied message",
 }
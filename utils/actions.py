@@ -0,0 +1,275 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+
+from pyrogram.errors import FloodWait, RPCError
+
+
+class ActionQueue:
+    """Background queue for API side effects (blocks, reports, deletions...).
+
+    Actions are keyed, an action whose key is already queued is dropped, so
+    a burst of updates about the same peer costs one call. A small pool of
+    workers runs them off the handlers; on FloodWait the worker that hit it
+    sleeps and retries, and the other workers wait for the same deadline.
+    """
+
+    def __init__(self, workers: int = 1, max_queue: int = 1000, retries: int = 3):
+        self._workers_count = max(1, workers)
+        self._retries = retries
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._pending = set()
+        self._workers = []
+        self._resume = None
+        self.stats = {"queued": 0, "done": 0, "merged": 0, "dropped": 0, "failed": 0}
+
+    def submit(self, key, func, *args, **kwargs) -> bool:
+        """Queue ``await func(*args, **kwargs)`` unless ``key`` is pending"""
+        if key in self._pending:
+            self.stats["merged"] += 1
+            return False
+        try:
+            self._queue.put_nowait((key, func, args, kwargs))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            return False
+        self._pending.add(key)
+        self.stats["queued"] += 1
+        self._start()
+        return True
+
+    def pending(self, key) -> bool:
+        return key in self._pending
+
+    async def join(self):
+        """Wait until everything queued so far has been run"""
+        await self._queue.join()
+
+    async def close(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        self._workers = [task for task in self._workers if not task.done()]
+        while len(self._workers) < self._workers_count:
+            self._workers.append(loop.create_task(self._worker()))
+
+    async def _flood_wait(self):
+        while self._resume is not None:
+            delay = self._resume - asyncio.get_running_loop().time()
+            if delay <= 0:
+                self._resume = None
+                break
+            await asyncio.sleep(delay)
+
+    async def _worker(self):
+        while True:
+            key, func, args, kwargs = await self._queue.get()
+            try:
+                await self._run(key, func, args, kwargs)
+            finally:
+                self._pending.discard(key)
+                self._queue.task_done()
+
+    async def _run(self, key, func, args, kwargs):
+        for _ in range(self._retries + 1):
+            await self._flood_wait()
+            try:
+                await func(*args, **kwargs)
+            except FloodWait as e:
+                logging.warning("[ACTIONS] FloodWait of %ss on %s", e.value, key)
+                self._resume = asyncio.get_running_loop().time() + e.value
+                continue
+            except RPCError as e:
+                logging.error("[ACTIONS] %s failed: %s", key, e)
+                self.stats["failed"] += 1
+                return
+            except Exception as e:
+                logging.exception("[ACTIONS] %s raised: %s", key, e)
+                self.stats["failed"] += 1
+                return
+            self.stats["done"] += 1
+            return
+        self.stats["failed"] += 1
+
+
+class DeleteBatcher:
+    """Groups message deletions per chat into ``delete_messages`` calls.
+
+    Ids are collected for ``delay`` seconds after the first one, or until
+    ``max_batch`` (Telegram accepts up to 100) are pending, then deleted with
+    one call through ``queue``.
+    """
+
+    def __init__(self, queue: ActionQueue, delay: float = 0.5, max_batch: int = 100):
+        self._queue = queue
+        self._delay = delay
+        self._max_batch = max_batch
+        self._batches = {}
+
+    def delete(self, client, chat_id: int, message_id: int):
+        batch = self._batches.setdefault(chat_id, [])
+        batch.append(message_id)
+        if len(batch) >= self._max_batch:
+            self._flush(client, chat_id)
+        elif len(batch) == 1:
+            asyncio.get_running_loop().call_later(
+                self._delay, self._flush, client, chat_id
+            )
+
+    def _flush(self, client, chat_id: int):
+        message_ids = self._batches.pop(chat_id, None)
+        if message_ids:
+            self._queue.submit(
+                ("delete", chat_id, message_ids[0]),
+                client.delete_messages,
+                chat_id,
+                message_ids,
+            )
+
+
+class BulkExecutor:
+    """Runs one coroutine per target with bounded, adaptive concurrency.
+
+    At most ``concurrency`` calls are in flight. A FloodWait pauses every
+    worker until it is over, halves the number of calls allowed at once and
+    the target is retried; every ``grow_after`` successes one more call is
+    allowed again, up to ``concurrency``. ``progress(done, total)`` is
+    awaited at most every ``progress_interval`` seconds. :meth:`run` and
+    :meth:`stream` return a summary dict with ``done``, ``failed``,
+    ``errors`` (count per error name), ``total`` and ``elapsed``.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 5,
+        retries: int = 3,
+        progress_interval: float = 3,
+        grow_after: int = 20,
+    ):
+        self._concurrency = max(1, concurrency)
+        self._retries = retries
+        self._progress_interval = progress_interval
+        self._grow_after = grow_after
+        self._resume = 0
+        self._active = 0
+        self._streak = 0
+        self._slots = None
+        self.limit = self._concurrency
+
+    async def _acquire(self):
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+
+    async def _release(self, flood: bool):
+        async with self._slots:
+            self._active -= 1
+            if flood:
+                self.limit = max(1, self.limit // 2)
+                self._streak = 0
+            else:
+                self._streak += 1
+                if self._streak >= self._grow_after and self.limit < self._concurrency:
+                    self.limit += 1
+                    self._streak = 0
+            self._slots.notify_all()
+
+    async def _call(self, func, target, summary: dict):
+        loop = asyncio.get_running_loop()
+        for _ in range(self._retries + 1):
+            delay = self._resume - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._acquire()
+            flood = False
+            try:
+                await func(target)
+            except FloodWait as e:
+                self._resume = max(self._resume, loop.time() + e.value)
+                flood = True
+                continue
+            except Exception as e:
+                name = type(e).__name__
+                summary["errors"][name] = summary["errors"].get(name, 0) + 1
+                summary["failed"] += 1
+                return
+            finally:
+                await self._release(flood)
+            summary["done"] += 1
+            return
+        summary["errors"]["FloodWait"] = summary["errors"].get("FloodWait", 0) + 1
+        summary["failed"] += 1
+
+    async def run(self, targets: list, func, progress=None) -> dict:
+        async def iterate():
+            for target in targets:
+                yield target
+
+        return await self.stream(iterate(), func, progress)
+
+    async def stream(self, targets, func, progress=None) -> dict:
+        """Like :meth:`run` for an async iterable, consumed as workers free up"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        summary = {"done": 0, "failed": 0, "errors": {}, "total": 0}
+        self._slots = asyncio.Condition()
+        queue = asyncio.Queue(maxsize=self._concurrency * 2)
+
+        async def stop_workers():
+            for _ in range(self._concurrency):
+                await queue.put(None)
+
+        async def produce():
+            # no stop markers when cancelled, the workers are cancelled too
+            # and putting them into a full queue would block forever
+            try:
+                async for target in targets:
+                    summary["total"] += 1
+                    await queue.put(target)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await stop_workers()
+                raise
+            await stop_workers()
+
+        async def worker():
+            while (target := await queue.get()) is not None:
+                await self._call(func, target, summary)
+
+        producer = loop.create_task(produce())
+        pending = {producer}
+        pending.update(loop.create_task(worker()) for _ in range(self._concurrency))
+        try:
+            while pending:
+                _, pending = await asyncio.wait(
+                    pending, timeout=self._progress_interval
+                )
+                if pending and progress is not None:
+                    await progress(summary["done"] + summary["failed"], summary["total"])
+        finally:
+            for task in pending:
+                task.cancel()
+        summary["elapsed"] = loop.time() - started
+        if producer.exception() is not None:
+            summary["error"] = producer.exception()
+        return summary
@@ -0,0 +1,231 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Value codecs for the SQLite backend.
+
+Every codec turns a non-scalar value into ``(payload, type)`` where ``type``
+is stored next to the payload and selects the decoder on read, so rows
+written by different codecs (including legacy JSON text) can coexist.
+
+Run ``python -m utils.codec`` to benchmark the codecs.
+"""
+
+import json
+import sys
+from array import array
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Lists of at least this many ints are stored as raw int64 arrays
+ARRAY_MIN = 8
+ARRAY_KEY = "\x00arr"
+
+_INT_ARRAY = b"\x01"
+_JSON_WITH_ARRAYS = b"\x02"
+
+
+def _to_bytes(arr: array) -> bytes:
+    if sys.byteorder == "big":
+        arr = array("q", arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _from_bytes(data) -> array:
+    arr = array("q")
+    arr.frombytes(data)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def _int_array(value) -> array | None:
+    if len(value) < ARRAY_MIN or set(map(type, value)) != {int}:
+        return None
+    try:
+        return array("q", value)
+    except OverflowError:
+        return None
+
+
+def _extract(value, arrays: list):
+    """Replace long int lists by markers and collect them as arrays"""
+    kind = type(value)
+    if kind is list or kind is tuple:
+        arr = _int_array(value)
+        if arr is not None:
+            arrays.append(arr)
+            return {ARRAY_KEY: len(arrays) - 1}
+        return [_extract(item, arrays) for item in value]
+    if kind is dict:
+        return {key: _extract(item, arrays) for key, item in value.items()}
+    return value
+
+
+def _write_varint(out: bytearray, number: int):
+    while number > 0x7F:
+        out.append(number & 0x7F | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def _read_varint(data, pos: int) -> tuple:
+    number = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, pos
+        shift += 7
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, value) -> tuple:
+        return json.dumps(value), self.name
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class BinaryCodec:
+    """JSON with int64 arrays for long lists of ints.
+
+    A value that is itself an int list is stored as a bare array. Values
+    without any int list stay plain JSON text.
+    """
+
+    name = "bin"
+
+    def encode(self, value) -> tuple:
+        if type(value) is list or type(value) is tuple:
+            arr = _int_array(value)
+            if arr is not None:
+                return _INT_ARRAY + _to_bytes(arr), self.name
+
+        arrays = []
+        body = _extract(value, arrays)
+        if not arrays:
+            return json.dumps(value), JsonCodec.name
+
+        out = bytearray(_JSON_WITH_ARRAYS)
+        _write_varint(out, len(arrays))
+        for arr in arrays:
+            raw = _to_bytes(arr)
+            _write_varint(out, len(raw))
+            out += raw
+        out += json.dumps(body).encode()
+        return bytes(out), self.name
+
+    def decode(self, data):
+        data = memoryview(data)
+        if data[:1] == _INT_ARRAY:
+            return _from_bytes(data[1:]).tolist()
+
+        count, pos = _read_varint(data, 1)
+        arrays = []
+        for _ in range(count):
+            size, pos = _read_varint(data, pos)
+            arrays.append(_from_bytes(data[pos : pos + size]).tolist())
+            pos += size
+
+        def restore(obj: dict):
+            if len(obj) == 1 and ARRAY_KEY in obj:
+                return arrays[obj[ARRAY_KEY]]
+            return obj
+
+        return json.loads(bytes(data[pos:]), object_hook=restore)
+
+
+class MsgpackCodec:
+    """msgpack encoding, only available when the msgpack package is installed.
+
+    Unlike JSON it keeps non-string dict keys as they are.
+    """
+
+    name = "msgpack"
+
+    def encode(self, value) -> tuple:
+        return msgpack.packb(value, use_bin_type=True), self.name
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+CODECS = {JsonCodec.name: JsonCodec(), BinaryCodec.name: BinaryCodec()}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def get_codec(name: str):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown or unavailable value codec: {name}") from None
+
+
+def decode(data, type_name: str):
+    """Decode a stored payload with the codec recorded next to it"""
+    return get_codec(type_name).decode(data)
+
+
+def benchmark(rounds: int = 20):
+    import random
+    import timeit
+
+    samples = {
+        "catalog (100k ids)": {
+            "group_id": -1001234567890,
+            "group_title": "Some group",
+            "total_members": 100000,
+            "catalog_date": "2024-01-01T00:00:00",
+            "user_ids": [random.randint(10**8, 8 * 10**9) for _ in range(100000)],
+        },
+        "rentry urls (500)": {
+            "allUrls": {
+                f"{i:032x}": {
+                    "url": f"abc{i}",
+                    "edit_code": f"code{i}",
+                    "time": "01 10:00:00 AM 2024",
+                }
+                for i in range(500)
+            }
+        },
+        "tmute list (50)": [random.randint(10**8, 8 * 10**9) for _ in range(50)],
+    }
+
+    print(f"{'value':<20} {'codec':<8} {'size':>10} {'encode ms':>10} {'decode ms':>10}")
+    for label, value in samples.items():
+        for codec in CODECS.values():
+            payload, type_name = codec.encode(value)
+            encode = timeit.timeit(lambda: codec.encode(value), number=rounds)
+            decode_time = timeit.timeit(
+                lambda: decode(payload, type_name), number=rounds
+            )
+            size = len(payload.encode() if isinstance(payload, str) else payload)
+            print(
+                f"{label:<20} {codec.name:<8} {size:>10} "
+                f"{encode / rounds * 1000:>10.3f} {decode_time / rounds * 1000:>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -30,3 +30,101 @@ test_server = bool(os.getenv("TEST_SERVER", env.bool("TEST_SERVER", False)))
 modules_repo_branch = os.getenv(
     "MODULES_REPO_BRANCH", env.str("MODULES_REPO_BRANCH", "master")
 )
+
+log_batch_size = int(os.getenv("LOG_BATCH_SIZE", env.int("LOG_BATCH_SIZE", 100)))
+log_flush_interval = float(
+    os.getenv("LOG_FLUSH_INTERVAL", env.float("LOG_FLUSH_INTERVAL", 2.0))
+)
+log_queue_size = int(os.getenv("LOG_QUEUE_SIZE", env.int("LOG_QUEUE_SIZE", 10000)))
+log_drop_policy = os.getenv("LOG_DROP_POLICY", env.str("LOG_DROP_POLICY", "oldest"))
+
+media_dir = os.getenv("MEDIA_DIR", env.str("MEDIA_DIR", ""))
+media_workers = int(os.getenv("MEDIA_WORKERS", env.int("MEDIA_WORKERS", 3)))
+media_queue_size = int(os.getenv("MEDIA_QUEUE_SIZE", env.int("MEDIA_QUEUE_SIZE", 100)))
+media_max_size = int(
+    os.getenv("MEDIA_MAX_SIZE", env.int("MEDIA_MAX_SIZE", 20 * 1024 * 1024))
+)
+
+db_cache_size = int(os.getenv("DB_CACHE_SIZE", env.int("DB_CACHE_SIZE", 4096)))
+db_cache_ttl = float(os.getenv("DB_CACHE_TTL", env.float("DB_CACHE_TTL", 0)))
+
+db_journal_mode = os.getenv("DB_JOURNAL_MODE", env.str("DB_JOURNAL_MODE", "WAL"))
+db_synchronous = os.getenv("DB_SYNCHRONOUS", env.str("DB_SYNCHRONOUS", "NORMAL"))
+db_group_commit_ms = int(
+    os.getenv("DB_GROUP_COMMIT_MS", env.int("DB_GROUP_COMMIT_MS", 0))
+)
+db_value_codec = os.getenv("DB_VALUE_CODEC", env.str("DB_VALUE_CODEC", "bin"))
+
+mongo_max_pool_size = int(
+    os.getenv("MONGO_MAX_POOL_SIZE", env.int("MONGO_MAX_POOL_SIZE", 10))
+)
+mongo_min_pool_size = int(
+    os.getenv("MONGO_MIN_POOL_SIZE", env.int("MONGO_MIN_POOL_SIZE", 0))
+)
+mongo_max_idle_ms = int(
+    os.getenv("MONGO_MAX_IDLE_MS", env.int("MONGO_MAX_IDLE_MS", 300000))
+)
+mongo_connect_timeout_ms = int(
+    os.getenv("MONGO_CONNECT_TIMEOUT_MS", env.int("MONGO_CONNECT_TIMEOUT_MS", 10000))
+)
+mongo_server_selection_timeout_ms = int(
+    os.getenv(
+        "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+        env.int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000),
+    )
+)
+mongo_compressors = os.getenv(
+    "MONGO_COMPRESSORS", env.str("MONGO_COMPRESSORS", "zlib")
+)
+mongo_write_concern = os.getenv(
+    "MONGO_WRITE_CONCERN", env.str("MONGO_WRITE_CONCERN", "")
+)
+mongo_read_concern = os.getenv("MONGO_READ_CONCERN", env.str("MONGO_READ_CONCERN", ""))
+mongo_dns = os.getenv("MONGO_DNS", env.str("MONGO_DNS", "1.1.1.1"))
+
+log_mongo_uri = os.getenv("MONGO_URI", env.str("MONGO_URI", ""))
+log_mongo_db = os.getenv("MONGO_DB", env.str("MONGO_DB", "telegram_logs"))
+
+filter_regex_timeout = float(
+    os.getenv("FILTER_REGEX_TIMEOUT", env.float("FILTER_REGEX_TIMEOUT", 0.1))
+)
+
+# Filter replies per minute, per chat and per trigger
+filter_chat_rate = float(
+    os.getenv("FILTER_CHAT_RATE", env.float("FILTER_CHAT_RATE", 20))
+)
+filter_chat_burst = int(
+    os.getenv("FILTER_CHAT_BURST", env.int("FILTER_CHAT_BURST", 5))
+)
+filter_trigger_rate = float(
+    os.getenv("FILTER_TRIGGER_RATE", env.float("FILTER_TRIGGER_RATE", 6))
+)
+filter_trigger_burst = int(
+    os.getenv("FILTER_TRIGGER_BURST", env.int("FILTER_TRIGGER_BURST", 2))
+)
+filter_coalesce_window = float(
+    os.getenv("FILTER_COALESCE_WINDOW", env.float("FILTER_COALESCE_WINDOW", 10))
+)
+
+afk_reply_window = int(os.getenv("AFK_REPLY_WINDOW", env.int("AFK_REPLY_WINDOW", 300)))
+afk_snapshot_interval = int(
+    os.getenv("AFK_SNAPSHOT_INTERVAL", env.int("AFK_SNAPSHOT_INTERVAL", 60))
+)
+
+peer_cache_ttl = int(os.getenv("PEER_CACHE_TTL", env.int("PEER_CACHE_TTL", 600)))
+peer_cache_size = int(os.getenv("PEER_CACHE_SIZE", env.int("PEER_CACHE_SIZE", 4096)))
+
+antipm_warning_ttl = int(
+    os.getenv("ANTIPM_WARNING_TTL", env.int("ANTIPM_WARNING_TTL", 86400))
+)
+antipm_ledger_size = int(
+    os.getenv("ANTIPM_LEDGER_SIZE", env.int("ANTIPM_LEDGER_SIZE", 1000))
+)
+
+tmute_sweep_interval = int(
+    os.getenv("TMUTE_SWEEP_INTERVAL", env.int("TMUTE_SWEEP_INTERVAL", 60))
+)
+
+bulk_concurrency = int(os.getenv("BULK_CONCURRENCY", env.int("BULK_CONCURRENCY", 5)))
+
+name_cache_ttl = int(os.getenv("NAME_CACHE_TTL", env.int("NAME_CACHE_TTL", 86400)))
@@ -15,18 +15,289 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import re
-import json
+import copy
+import time
+import asyncio
+import logging
 import threading
 import sqlite3
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from dns import resolver
 import pymongo
+from pymongo import monitoring
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
 from utils import config
+from utils.codec import decode, get_codec
 
-resolver.default_resolver = resolver.Resolver(configure=False)
-resolver.default_resolver.nameservers = ["1.1.1.1"]
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:
+    AsyncMongoClient = None
 
+# Keep IN (...) lists below SQLite's host parameter limit
+SQLITE_CHUNK = 500
 
-class Database:
+MODULE_NAME = re.compile(r"^(core|custom)")
+
+# The primary key doubles as the covering index: WITHOUT ROWID tables keep
+# whole rows in the (module, var) b-tree.
+SQL_CREATE = """
+CREATE TABLE IF NOT EXISTS kv (
+    module TEXT NOT NULL,
+    var TEXT NOT NULL,
+    val BLOB NOT NULL,
+    type TEXT NOT NULL,
+    PRIMARY KEY (module, var)
+) WITHOUT ROWID
+"""
+SQL_LEGACY_TABLES = (
+    "SELECT name FROM sqlite_master WHERE type='table' AND name != 'kv'"
+)
+SQL_GET = "SELECT var, val, type FROM kv WHERE module=? AND var=?"
+SQL_GET_MANY = "SELECT var, val, type FROM kv WHERE module=? AND var IN ({})"
+SQL_COLLECTION = "SELECT var, val, type FROM kv WHERE module=?"
+SQL_PREFIX = "SELECT var, val, type FROM kv WHERE module=? AND var>=? AND var<?"
+SQL_SET = """
+INSERT INTO kv (module, var, val, type) VALUES (?, ?, ?, ?)
+ON CONFLICT (module, var) DO UPDATE SET val=excluded.val, type=excluded.type
+"""
+SQL_REMOVE = "DELETE FROM kv WHERE module=? AND var=?"
+SQL_REMOVE_MANY = "DELETE FROM kv WHERE module=? AND var IN ({})"
+
+
+@lru_cache(maxsize=None)
+def _check_module(module: str):
+    if not MODULE_NAME.match(module):
+        raise ValueError(f"Invalid module name format: {module}")
+
+
+class InvalidationBus:
+    """Notifies in-memory caches about writes to a module namespace.
+
+    Subscribers are called as ``callback(module, variables)`` after every
+    write, with the tuple of written variables, or None when the whole
+    module may have changed. Callbacks can run in a database worker thread,
+    they should only mark things stale and never touch the database.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+
+    def subscribe(self, module: str, callback):
+        self._subscribers.setdefault(module, []).append(callback)
+
+    def unsubscribe(self, module: str, callback):
+        callbacks = self._subscribers.get(module, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def publish(self, module: str, variables=None):
+        for callback in self._subscribers.get(module, ()):
+            try:
+                callback(module, variables)
+            except Exception:
+                logging.exception("Invalidation callback for %s failed", module)
+
+
+bus = InvalidationBus()
+
+
+class MongoPoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters shared by every Mongo client of the process"""
+
+    def __init__(self):
+        self.counters = {
+            "created": 0,
+            "closed": 0,
+            "checked_out": 0,
+            "checked_in": 0,
+            "checkout_failed": 0,
+            "pools_cleared": 0,
+        }
+
+    @property
+    def in_use(self) -> int:
+        return self.counters["checked_out"] - self.counters["checked_in"]
+
+    @property
+    def open(self) -> int:
+        return self.counters["created"] - self.counters["closed"]
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.counters["pools_cleared"] += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.counters["created"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.counters["closed"] += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.counters["checkout_failed"] += 1
+
+    def connection_checked_out(self, event):
+        self.counters["checked_out"] += 1
+
+    def connection_checked_in(self, event):
+        self.counters["checked_in"] += 1
+
+
+mongo_pool_stats = MongoPoolStats()
+_mongo_clients = {}
+_async_mongo_clients = {}
+_mongo_lock = threading.Lock()
+_dns_configured = False
+
+
+def _configure_dns():
+    """Point dnspython at MONGO_DNS for mongodb+srv lookups"""
+    global _dns_configured
+    if config.mongo_dns and not _dns_configured:
+        resolver.default_resolver = resolver.Resolver(configure=False)
+        resolver.default_resolver.nameservers = config.mongo_dns.split(",")
+        _dns_configured = True
+
+
+def _mongo_options() -> dict:
+    options = {
+        "maxPoolSize": config.mongo_max_pool_size,
+        "minPoolSize": config.mongo_min_pool_size,
+        "maxIdleTimeMS": config.mongo_max_idle_ms,
+        "connectTimeoutMS": config.mongo_connect_timeout_ms,
+        "serverSelectionTimeoutMS": config.mongo_server_selection_timeout_ms,
+        "event_listeners": [mongo_pool_stats],
+    }
+    if config.mongo_compressors:
+        options["compressors"] = config.mongo_compressors
+    if config.mongo_write_concern:
+        w = config.mongo_write_concern
+        options["w"] = int(w) if w.isdigit() else w
+    if config.mongo_read_concern:
+        options["readConcernLevel"] = config.mongo_read_concern
+    return options
+
+
+def get_mongo_client(url: str = None) -> pymongo.MongoClient:
+    """Return the process-wide client (and connection pool) for a Mongo url"""
+    url = url or config.db_url or None
+    with _mongo_lock:
+        if url not in _mongo_clients:
+            if url and url.startswith("mongodb+srv://"):
+                _configure_dns()
+            _mongo_clients[url] = pymongo.MongoClient(url, **_mongo_options())
+        return _mongo_clients[url]
+
+
+def get_async_mongo_client(url: str = None):
+    """Async counterpart of ``get_mongo_client``, needs pymongo's AsyncMongoClient"""
+    url = url or config.db_url or None
+    with _mongo_lock:
+        if url not in _async_mongo_clients:
+            if url and url.startswith("mongodb+srv://"):
+                _configure_dns()
+            _async_mongo_clients[url] = AsyncMongoClient(url, **_mongo_options())
+        return _async_mongo_clients[url]
+
+
+def mongo_health(url: str = None) -> dict:
+    """Ping the server through the shared pool"""
+    client = get_mongo_client(url)
+    start = time.monotonic()
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        return {"ok": False, "error": str(e)}
+    return {"ok": True, "latency_ms": round((time.monotonic() - start) * 1000, 2)}
+
+
+def mongo_pool_info() -> dict:
+    return {
+        "clients": len(_mongo_clients) + len(_async_mongo_clients),
+        "open": mongo_pool_stats.open,
+        "in_use": mongo_pool_stats.in_use,
+        **mongo_pool_stats.counters,
+    }
+
+
+def index_usage(collection) -> list:
+    """Read ``$indexStats`` of a collection as (name, keys, ops, since) tuples"""
+    return [
+        (
+            stat["name"],
+            ", ".join(f"{k}:{v}" for k, v in stat["key"].items()),
+            stat["accesses"]["ops"],
+            stat["accesses"]["since"],
+        )
+        for stat in collection.aggregate([{"$indexStats": {}}])
+    ]
+
+
+def close_mongo_clients():
+    with _mongo_lock:
+        for client in _mongo_clients.values():
+            client.close()
+        _mongo_clients.clear()
+
+
+class AsyncDatabase:
+    """Awaitable database interface.
+
+    The default implementation runs the synchronous methods in a worker
+    thread, backends override it with a native implementation.
+    """
+
+    async def aget(self, module: str, variable: str, default=None):
+        """Get value from database"""
+        return await asyncio.to_thread(self.get, module, variable, default)
+
+    async def aset(self, module: str, variable: str, value):
+        """Set key in database"""
+        return await asyncio.to_thread(self.set, module, variable, value)
+
+    async def aremove(self, module: str, variable: str):
+        """Remove key from database"""
+        return await asyncio.to_thread(self.remove, module, variable)
+
+    async def aget_collection(self, module: str) -> dict:
+        """Get database for selected module"""
+        return await asyncio.to_thread(self.get_collection, module)
+
+    async def aget_prefix(self, module: str, prefix: str) -> dict:
+        """Get the keys of a module that start with prefix"""
+        return await asyncio.to_thread(self.get_prefix, module, prefix)
+
+    async def aget_many(self, module: str, variables, default=None) -> dict:
+        """Get several values of one module"""
+        return await asyncio.to_thread(self.get_many, module, variables, default)
+
+    async def aset_many(self, module: str, values: dict):
+        """Set several keys of one module"""
+        return await asyncio.to_thread(self.set_many, module, values)
+
+    async def aremove_many(self, module: str, variables):
+        """Remove several keys of one module"""
+        return await asyncio.to_thread(self.remove_many, module, variables)
+
+
+class Database(AsyncDatabase):
     def get(self, module: str, variable: str, default=None):
         """Get value from database"""
         raise NotImplementedError
@@ -43,22 +314,133 @@ class Database:
         """Get database for selected module"""
         raise NotImplementedError
 
+    def get_prefix(self, module: str, prefix: str) -> dict:
+        """Get the keys of a module that start with prefix"""
+        return {
+            var: val
+            for var, val in self.get_collection(module).items()
+            if var.startswith(prefix)
+        }
+
+    def get_many(self, module: str, variables, default=None) -> dict:
+        """Get several values of one module, missing keys map to default"""
+        return {var: self.get(module, var, default) for var in variables}
+
+    def set_many(self, module: str, values: dict):
+        """Set several keys of one module"""
+        with self.transaction():
+            for var, value in values.items():
+                self.set(module, var, value)
+
+    def remove_many(self, module: str, variables):
+        """Remove several keys of one module"""
+        with self.transaction():
+            for var in variables:
+                self.remove(module, var)
+
     def close(self):
         """Close the database"""
         raise NotImplementedError
 
+    @contextmanager
+    def transaction(self):
+        """Group several writes into one atomic commit"""
+        yield self
+
+    def flush(self):
+        """Persist writes that are still waiting for a group commit"""
+
+    def ensure_indexes(self) -> int:
+        """Create the indexes the backend relies on"""
+        return 0
+
+    def add_chat_history(self, user_id, message):
+        chat_history = self.get_chat_history(user_id, default=[])
+        chat_history.append(message)
+        self.set(f"core.cohere.user_{user_id}", "chat_history", chat_history)
+
+    def get_chat_history(self, user_id, default=None):
+        if default is None:
+            default = []
+        return self.get(f"core.cohere.user_{user_id}", "chat_history", default=[])
+
+    def addaiuser(self, user_id):
+        chatai_users = self.get("core.chatbot", "chatai_users", default=[])
+        if user_id not in chatai_users:
+            chatai_users.append(user_id)
+            self.set("core.chatbot", "chatai_users", chatai_users)
+
+    def remaiuser(self, user_id):
+        chatai_users = self.get("core.chatbot", "chatai_users", default=[])
+        if user_id in chatai_users:
+            chatai_users.remove(user_id)
+            self.set("core.chatbot", "chatai_users", chatai_users)
+
+    def getaiusers(self):
+        return self.get("core.chatbot", "chatai_users", default=[])
+
 
 class MongoDatabase(Database):
     def __init__(self, url, name):
-        self._client = pymongo.MongoClient(url)
+        self._url = url
+        self._name = name
+        self._client = get_mongo_client(url)
         self._database = self._client[name]
+        self._indexed = set()
+
+    @property
+    def _adatabase(self):
+        return get_async_mongo_client(self._url)[self._name]
+
+    def ensure_indexes(self) -> int:
+        """Create the unique ``var`` index on every existing module collection.
+
+        Returns the number of collections that were checked.
+        """
+        names = self._database.list_collection_names()
+        for module in names:
+            self._ensure_index(module)
+        return len(names)
+
+    def _ensure_index(self, module: str):
+        if module in self._indexed:
+            return
+        try:
+            self._database[module].create_index("var", unique=True, name="var_1")
+        except DuplicateKeyError:
+            logging.warning("Duplicate keys in %s, creating a non-unique index", module)
+            self._database[module].create_index("var", name="var_1")
+        except OperationFailure as e:
+            # an index on var already exists with other options, keep it
+            logging.warning("Keeping existing var index of %s: %s", module, e)
+        self._indexed.add(module)
+
+    async def _aensure_index(self, module: str):
+        if module in self._indexed:
+            return
+        collection = self._adatabase[module]
+        try:
+            await collection.create_index("var", unique=True, name="var_1")
+        except DuplicateKeyError:
+            logging.warning("Duplicate keys in %s, creating a non-unique index", module)
+            await collection.create_index("var", name="var_1")
+        except OperationFailure as e:
+            # an index on var already exists with other options, keep it
+            logging.warning("Keeping existing var index of %s: %s", module, e)
+        self._indexed.add(module)
+
+    def index_stats(self, module: str) -> list:
+        """Usage counters of every index of a module collection"""
+        return index_usage(self._database[module])
 
     def set(self, module: str, variable: str, value):
         if not isinstance(module, str) or not isinstance(variable, str):
             raise ValueError("Module and variable must be strings")
+        self._ensure_index(module)
         self._database[module].replace_one(
             {"var": variable}, {"var": variable, "val": value}, upsert=True
         )
+        bus.publish(module, (variable,))
 
     def get(self, module: str, variable: str, default=None):
         if not isinstance(module, str) or not isinstance(variable, str):
@@ -75,42 +457,161 @@ class MongoDatabase(Database):
         if not isinstance(module, str) or not isinstance(variable, str):
             raise ValueError("Module and variable must be strings")
         self._database[module].delete_one({"var": variable})
+        bus.publish(module, (variable,))
+
+    def get_prefix(self, module: str, prefix: str) -> dict:
+        if not isinstance(module, str) or not isinstance(prefix, str):
+            raise ValueError("Module and prefix must be strings")
+        return {
+            item["var"]: item["val"]
+            for item in self._database[module].find(
+                {"var": {"$regex": f"^{re.escape(prefix)}"}}
+            )
+        }
+
+    def get_many(self, module: str, variables, default=None) -> dict:
+        if not isinstance(module, str):
+            raise ValueError("Module must be a string")
+        variables = list(variables)
+        result = dict.fromkeys(variables, default)
+        for doc in self._database[module].find({"var": {"$in": variables}}):
+            result[doc["var"]] = doc["val"]
+        return result
+
+    def set_many(self, module: str, values: dict):
+        if not isinstance(module, str):
+            raise ValueError("Module must be a string")
+        if values:
+            self._ensure_index(module)
+            self._database[module].bulk_write(self._replace_ops(values), ordered=False)
+            bus.publish(module, tuple(values))
+
+    def remove_many(self, module: str, variables):
+        if not isinstance(module, str):
+            raise ValueError("Module must be a string")
+        variables = list(variables)
+        self._database[module].delete_many({"var": {"$in": variables}})
+        bus.publish(module, tuple(variables))
+
+    @staticmethod
+    def _replace_ops(values: dict) -> list:
+        return [
+            pymongo.ReplaceOne({"var": var}, {"var": var, "val": val}, upsert=True)
+            for var, val in values.items()
+        ]
 
     def close(self):
-        self._client.close()
+        close_mongo_clients()
 
-    def add_chat_history(self, user_id, message):
-        chat_history = self.get_chat_history(user_id, default=[])
-        chat_history.append(message)
-        self.set(f"core.cohere.user_{user_id}", "chat_history", chat_history)
+    async def aset(self, module: str, variable: str, value):
+        if AsyncMongoClient is None:
+            return await super().aset(module, variable, value)
+        if not isinstance(module, str) or not isinstance(variable, str):
+            raise ValueError("Module and variable must be strings")
+        await self._aensure_index(module)
+        await self._adatabase[module].replace_one(
+            {"var": variable}, {"var": variable, "val": value}, upsert=True
+        )
+        bus.publish(module, (variable,))
 
-    def get_chat_history(self, user_id, default=None):
-        if default is None:
-            default = []
-        return self.get(f"core.cohere.user_{user_id}", "chat_history", default=[])
+    async def aget(self, module: str, variable: str, default=None):
+        if AsyncMongoClient is None:
+            return await super().aget(module, variable, default)
+        if not isinstance(module, str) or not isinstance(variable, str):
+            raise ValueError("Module and variable must be strings")
+        doc = await self._adatabase[module].find_one({"var": variable})
+        return default if doc is None else doc["val"]
 
-    def addaiuser(self, user_id):
-        chatai_users = self.get("core.chatbot", "chatai_users", default=[])
-        if user_id not in chatai_users:
-            chatai_users.append(user_id)
-            self.set("core.chatbot", "chatai_users", chatai_users)
+    async def aget_collection(self, module: str) -> dict:
+        if AsyncMongoClient is None:
+            return await super().aget_collection(module)
+        if not isinstance(module, str):
+            raise ValueError("Module must be a string")
+        return {
+            item["var"]: item["val"] async for item in self._adatabase[module].find()
+        }
 
-    def remaiuser(self, user_id):
-        chatai_users = self.get("core.chatbot", "chatai_users", default=[])
-        if user_id in chatai_users:
-            chatai_users.remove(user_id)
-            self.set("core.chatbot", "chatai_users", chatai_users)
+    async def aremove(self, module: str, variable: str):
+        if AsyncMongoClient is None:
+            return await super().aremove(module, variable)
+        if not isinstance(module, str) or not isinstance(variable, str):
+            raise ValueError("Module and variable must be strings")
+        await self._adatabase[module].delete_one({"var": variable})
+        bus.publish(module, (variable,))
 
-    def getaiusers(self):
-        return self.get("core.chatbot", "chatai_users", default=[])
+    async def aget_many(self, module: str, variables, default=None) -> dict:
+        if AsyncMongoClient is None:
+            return await super().aget_many(module, variables, default)
+        if not isinstance(module, str):
+            raise ValueError("Module must be a string")
+        variables = list(variables)
+        result = dict.fromkeys(variables, default)
+        async for doc in self._adatabase[module].find({"var": {"$in": variables}}):
+            result[doc["var"]] = doc["val"]
+        return result
+
+    async def aset_many(self, module: str, values: dict):
+        if AsyncMongoClient is None:
+            return await super().aset_many(module, values)
+        if not isinstance(module, str):
+            raise ValueError("Module must be a string")
+        if values:
+            await self._aensure_index(module)
+            await self._adatabase[module].bulk_write(
+                self._replace_ops(values), ordered=False
+            )
+            bus.publish(module, tuple(values))
+
+    async def aremove_many(self, module: str, variables):
+        if AsyncMongoClient is None:
+            return await super().aremove_many(module, variables)
+        if not isinstance(module, str):
+            raise ValueError("Module must be a string")
+        variables = list(variables)
+        await self._adatabase[module].delete_many({"var": {"$in": variables}})
+        bus.publish(module, tuple(variables))
+
+    async def aclose(self):
+        clients = list(_async_mongo_clients.values())
+        _async_mongo_clients.clear()
+        for client in clients:
+            await client.close()
 
 
 class SqliteDatabase(Database):
-    def __init__(self, file):
-        self._conn = sqlite3.connect(file, check_same_thread=False)
+    """Key-value store on a single ``(module, var)``-keyed SQLite table.
+
+    Older databases that used one table per module are migrated into it
+    on startup, see ``migrate_legacy_tables``.
+    """
+
+    def __init__(
+        self,
+        file,
+        journal_mode: str = "WAL",
+        synchronous: str = "NORMAL",
+        commit_interval: float = 0,
+        codec: str = "bin",
+    ):
+        self._codec = get_codec(codec)
+        self._conn = sqlite3.connect(
+            file, check_same_thread=False, cached_statements=256
+        )
         self._conn.row_factory = sqlite3.Row
-        self._cursor = self._conn.cursor()
-        self._lock = threading.Lock()
+        self._conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._commit_interval = commit_interval
+        self._commit_timer = None
+        # All awaitable calls are serialized on one dedicated thread
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="sqlite"
+        )
+        with self._lock:
+            self._conn.execute(SQL_CREATE)
+            self._conn.commit()
+        self.migrate_legacy_tables()
 
     @staticmethod
     def _parse_row(row: sqlite3.Row):
@@ -120,118 +621,482 @@ class SqliteDatabase(Database):
             return int(row["val"])
         if row["type"] == "str":
             return row["val"]
-        return json.loads(row["val"])
+        return decode(row["val"], row["type"])
 
-    def _execute(self, module: str, *args, **kwargs) -> sqlite3.Cursor:
-        pattern = r"^(core|custom)"
-        if not re.match(pattern, module):
-            raise ValueError(f"Invalid module name format: {module}")
+    def _encode(self, value) -> tuple:
+        if isinstance(value, bool):
+            return "1" if value else "0", "bool"
+        if isinstance(value, str):
+            return value, "str"
+        if isinstance(value, int):
+            return str(value), "int"
+        return self._codec.encode(value)
 
-        self._lock.acquire()
-        try:
-            cursor = self._conn.cursor()
-            return cursor.execute(*args, **kwargs)
-        except sqlite3.OperationalError as e:
-            if str(e).startswith("no such table"):
-                sql = f"""
-                CREATE TABLE IF NOT EXISTS '{module}' (
-                var TEXT UNIQUE NOT NULL,
-                val TEXT NOT NULL,
-                type TEXT NOT NULL
-                )
-                """
-                cursor = self._conn.cursor()
-                cursor.execute(sql)
-                self._conn.commit()
-                return cursor.execute(*args, **kwargs)
-            raise e from None
-        finally:
-            self._lock.release()
+    def _execute(self, module: str, sql: str, params=()) -> list:
+        _check_module(module)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
 
-    def get(self, module: str, variable: str, default=None):
-        sql = f"SELECT * FROM '{module}' WHERE var=?"
-        cur = self._execute(module, sql, (variable,))
+    def migrate_legacy_tables(self) -> int:
+        """Move rows of the old per-module tables into the kv table.
+
+        Returns the number of migrated tables.
+        """
+        with self._lock:
+            tables = [
+                row["name"]
+                for row in self._conn.execute(SQL_LEGACY_TABLES).fetchall()
+                if MODULE_NAME.match(row["name"])
+            ]
+            if not tables:
+                return 0
+            with self.transaction():
+                for table in tables:
+                    name = table.replace('"', '""')
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO kv (module, var, val, type) "
+                        f'SELECT ?, var, val, type FROM "{name}"',
+                        (table,),
+                    )
+                    self._conn.execute(f'DROP TABLE "{name}"')
+        logging.info("Migrated %d legacy database tables", len(tables))
+        return len(tables)
 
-        row = cur.fetchone()
-        if row is None:
+    def get(self, module: str, variable: str, default=None):
+        rows = self._execute(module, SQL_GET, (module, variable))
+        if not rows:
             return default
-        return self._parse_row(row)
+        return self._parse_row(rows[0])
 
     def set(self, module: str, variable: str, value) -> bool:
-        sql = f"""
-        INSERT INTO '{module}' VALUES ( ?, ?, ? )
-        ON CONFLICT (var) DO
-        UPDATE SET val=?, type=? WHERE var=?
-        """
+        val, typ = self._encode(value)
 
-        if isinstance(value, bool):
-            val = "1" if value else "0"
-            typ = "bool"
-        elif isinstance(value, str):
-            val = value
-            typ = "str"
-        elif isinstance(value, int):
-            val = str(value)
-            typ = "int"
-        else:
-            val = json.dumps(value)
-            typ = "json"
-
-        self._execute(module, sql, (variable, val, typ, val, typ, variable))
-        self._conn.commit()
+        with self._lock:
+            self._execute(module, SQL_SET, (module, variable, val, typ))
+            self._commit()
+        bus.publish(module, (variable,))
 
         return True
 
     def remove(self, module: str, variable: str):
-        sql = f"DELETE FROM '{module}' WHERE var=?"
-        self._execute(module, sql, (variable,))
-        self._conn.commit()
+        with self._lock:
+            self._execute(module, SQL_REMOVE, (module, variable))
+            self._commit()
+        bus.publish(module, (variable,))
 
-    def get_collection(self, module: str) -> dict:
-        pattern = r"^(core|custom)"
-        if not re.match(pattern, module):
-            raise ValueError(f"Invalid module name format: {module}")
+    def get_many(self, module: str, variables, default=None) -> dict:
+        variables = list(variables)
+        result = dict.fromkeys(variables, default)
+        for i in range(0, len(variables), SQLITE_CHUNK):
+            chunk = variables[i : i + SQLITE_CHUNK]
+            sql = SQL_GET_MANY.format(",".join("?" * len(chunk)))
+            for row in self._execute(module, sql, (module, *chunk)):
+                result[row["var"]] = self._parse_row(row)
+        return result
 
-        sql = f"SELECT * FROM '{module}'"
-        cur = self._execute(module, sql)
+    def set_many(self, module: str, values: dict):
+        _check_module(module)
+        if not values:
+            return
+        rows = [(module, var, *self._encode(value)) for var, value in values.items()]
+        with self._lock:
+            self._conn.executemany(SQL_SET, rows)
+            self._commit()
+        bus.publish(module, tuple(values))
 
-        collection = {}
-        for row in cur:
-            collection[row["var"]] = self._parse_row(row)
+    def remove_many(self, module: str, variables):
+        variables = list(variables)
+        with self._lock:
+            for i in range(0, len(variables), SQLITE_CHUNK):
+                chunk = variables[i : i + SQLITE_CHUNK]
+                sql = SQL_REMOVE_MANY.format(",".join("?" * len(chunk)))
+                self._execute(module, sql, (module, *chunk))
+            self._commit()
+        bus.publish(module, tuple(variables))
 
-        return collection
+    def _commit(self):
+        """Commit now, or leave it to the group commit timer"""
+        if self._depth:
+            return
+        if not self._commit_interval:
+            self._conn.commit()
+        elif self._commit_timer is None:
+            self._commit_timer = threading.Timer(self._commit_interval, self.flush)
+            self._commit_timer.daemon = True
+            self._commit_timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._commit_timer is not None:
+                self._commit_timer.cancel()
+                self._commit_timer = None
+            if not self._depth:
+                self._conn.commit()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            if not self._depth:
+                self.flush()
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if not self._depth:
+                    self._conn.rollback()
+                raise
+            self._depth -= 1
+            if not self._depth:
+                self._conn.commit()
+
+    def get_collection(self, module: str) -> dict:
+        rows = self._execute(module, SQL_COLLECTION, (module,))
+        return {row["var"]: self._parse_row(row) for row in rows}
+
+    def get_prefix(self, module: str, prefix: str) -> dict:
+        if not prefix:
+            return self.get_collection(module)
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self._execute(module, SQL_PREFIX, (module, prefix, upper))
+        return {row["var"]: self._parse_row(row) for row in rows}
 
     def close(self):
-        self._conn.commit()
+        self._executor.shutdown(wait=True)
+        self.flush()
         self._conn.close()
 
-    def add_chat_history(self, user_id, message):
-        chat_history = self.get_chat_history(user_id, default=[])
-        chat_history.append(message)
-        self.set(f"core.cohere.user_{user_id}", "chat_history", chat_history)
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, func, *args
+        )
 
-    def get_chat_history(self, user_id, default=None):
-        if default is None:
-            default = []
-        return self.get(f"core.cohere.user_{user_id}", "chat_history", default=[])
+    async def aget(self, module: str, variable: str, default=None):
+        return await self._run(self.get, module, variable, default)
 
-    def addaiuser(self, user_id):
-        chatai_users = self.get("core.chatbot", "chatai_users", default=[])
-        if user_id not in chatai_users:
-            chatai_users.append(user_id)
-            self.set("core.chatbot", "chatai_users", chatai_users)
+    async def aset(self, module: str, variable: str, value):
+        return await self._run(self.set, module, variable, value)
 
-    def remaiuser(self, user_id):
-        chatai_users = self.get("core.chatbot", "chatai_users", default=[])
-        if user_id in chatai_users:
-            chatai_users.remove(user_id)
-            self.set("core.chatbot", "chatai_users", chatai_users)
+    async def aremove(self, module: str, variable: str):
+        return await self._run(self.remove, module, variable)
 
-    def getaiusers(self):
-        return self.get("core.chatbot", "chatai_users", default=[])
+    async def aget_collection(self, module: str) -> dict:
+        return await self._run(self.get_collection, module)
+
+    async def aget_prefix(self, module: str, prefix: str) -> dict:
+        return await self._run(self.get_prefix, module, prefix)
+
+    async def aget_many(self, module: str, variables, default=None) -> dict:
+        return await self._run(self.get_many, module, list(variables), default)
+
+    async def aset_many(self, module: str, values: dict):
+        return await self._run(self.set_many, module, values)
+
+    async def aremove_many(self, module: str, variables):
+        return await self._run(self.remove_many, module, list(variables))
+
+
+_MISSING = object()
+_UNKNOWN = object()
+
+
+def _copy(value):
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
+
+
+class CachedDatabase(Database):
+    """In-process read-through cache in front of another database.
+
+    Entries are kept per module namespace, written through on ``set`` and
+    ``remove`` and bounded by ``max_size`` (LRU) and ``ttl`` seconds
+    (0 disables expiry). Missing keys are cached too, and a namespace read
+    with ``get_collection`` answers every later lookup from memory.
+    """
+
+    def __init__(self, backend: Database, max_size: int = 4096, ttl: float = 0):
+        self._backend = backend
+        self._max_size = max_size
+        self._ttl = ttl
+        self._namespaces = {}
+        self._complete = {}
+        self._lru = OrderedDict()
+        self._lock = threading.RLock()
+        # bumped by every write, so reads that awaited the backend meanwhile
+        # don't cache what they fetched before the write
+        self._versions = {}
+        self._generation = 0
+        self.stats = {}
+
+    @property
+    def backend(self) -> Database:
+        return self._backend
+
+    def _expiry(self) -> float:
+        return time.monotonic() + self._ttl if self._ttl else 0
+
+    def _count(self, module: str, hit: bool):
+        counters = self.stats.setdefault(module, {"hits": 0, "misses": 0})
+        counters["hits" if hit else "misses"] += 1
+
+    def _bump(self, module: str):
+        self._versions[module] = self._versions.get(module, 0) + 1
+
+    def _version(self, module: str) -> tuple:
+        return self._generation, self._versions.get(module, 0)
+
+    def _store(self, module: str, variable: str, value):
+        self._namespaces.setdefault(module, {})[variable] = (value, self._expiry())
+        self._lru[(module, variable)] = None
+        self._lru.move_to_end((module, variable))
+        while len(self._lru) > self._max_size:
+            old_module, old_variable = self._lru.popitem(last=False)[0]
+            self._drop(old_module, old_variable)
+
+    def _drop(self, module: str, variable: str):
+        namespace = self._namespaces.get(module)
+        if namespace is not None:
+            namespace.pop(variable, None)
+        self._lru.pop((module, variable), None)
+        self._complete.pop(module, None)
+
+    def _lookup(self, module: str, variable: str):
+        namespace = self._namespaces.get(module)
+        if namespace is not None and variable in namespace:
+            value, expires = namespace[variable]
+            if not expires or expires > time.monotonic():
+                self._lru.move_to_end((module, variable))
+                return value
+            self._drop(module, variable)
+        expires = self._complete.get(module)
+        if expires is not None and (not expires or expires > time.monotonic()):
+            return _MISSING
+        return _UNKNOWN
+
+    def get(self, module: str, variable: str, default=None):
+        with self._lock:
+            value = self._lookup(module, variable)
+            self._count(module, value is not _UNKNOWN)
+            if value is _UNKNOWN:
+                value = self._backend.get(module, variable, _MISSING)
+                self._store(module, variable, value)
+            if value is _MISSING:
+                return default
+            return _copy(value)
+
+    def set(self, module: str, variable: str, value):
+        with self._lock:
+            result = self._backend.set(module, variable, value)
+            self._bump(module)
+            self._store(module, variable, _copy(value))
+        return result
+
+    def remove(self, module: str, variable: str):
+        with self._lock:
+            self._backend.remove(module, variable)
+            self._bump(module)
+            self._store(module, variable, _MISSING)
+
+    def _split_many(self, module: str, variables) -> tuple:
+        found, unknown = {}, []
+        for var in variables:
+            value = self._lookup(module, var)
+            self._count(module, value is not _UNKNOWN)
+            if value is _UNKNOWN:
+                unknown.append(var)
+            else:
+                found[var] = value
+        return found, unknown
+
+    def _merge_many(
+        self, module: str, found: dict, fetched: dict, default, store: bool = True
+    ) -> dict:
+        for var, value in fetched.items() if store else ():
+            self._store(module, var, value)
+        found.update(fetched)
+        return {
+            var: default if value is _MISSING else _copy(value)
+            for var, value in found.items()
+        }
+
+    def get_many(self, module: str, variables, default=None) -> dict:
+        with self._lock:
+            found, unknown = self._split_many(module, variables)
+            fetched = (
+                self._backend.get_many(module, unknown, _MISSING) if unknown else {}
+            )
+            return self._merge_many(module, found, fetched, default)
+
+    def set_many(self, module: str, values: dict):
+        with self._lock:
+            self._backend.set_many(module, values)
+            self._bump(module)
+            for var, value in values.items():
+                self._store(module, var, _copy(value))
+
+    def remove_many(self, module: str, variables):
+        variables = list(variables)
+        with self._lock:
+            self._backend.remove_many(module, variables)
+            self._bump(module)
+            for var in variables:
+                self._store(module, var, _MISSING)
+
+    async def aget_many(self, module: str, variables, default=None) -> dict:
+        with self._lock:
+            found, unknown = self._split_many(module, variables)
+            version = self._version(module)
+        fetched = (
+            await self._backend.aget_many(module, unknown, _MISSING) if unknown else {}
+        )
+        with self._lock:
+            store = self._version(module) == version
+            return self._merge_many(module, found, fetched, default, store)
+
+    async def aset_many(self, module: str, values: dict):
+        await self._backend.aset_many(module, values)
+        with self._lock:
+            self._bump(module)
+            for var, value in values.items():
+                self._store(module, var, _copy(value))
+
+    async def aremove_many(self, module: str, variables):
+        variables = list(variables)
+        await self._backend.aremove_many(module, variables)
+        with self._lock:
+            self._bump(module)
+            for var in variables:
+                self._store(module, var, _MISSING)
+
+    def _cached_collection(self, module: str) -> dict | None:
+        expires = self._complete.get(module)
+        if expires is None or expires and expires <= time.monotonic():
+            self._count(module, False)
+            return None
+        self._count(module, True)
+        return {
+            var: _copy(value)
+            for var, (value, _) in self._namespaces.get(module, {}).items()
+            if value is not _MISSING
+        }
+
+    def _fill_collection(self, module: str, collection: dict):
+        for var in list(self._namespaces.get(module, {})):
+            self._drop(module, var)
+        for var, value in collection.items():
+            self._store(module, var, _copy(value))
+        if len(collection) <= self._max_size:
+            self._complete[module] = self._expiry()
+
+    def get_prefix(self, module: str, prefix: str) -> dict:
+        with self._lock:
+            cached = self._cached_collection(module)
+            if cached is not None:
+                return {
+                    var: val for var, val in cached.items() if var.startswith(prefix)
+                }
+            collection = self._backend.get_prefix(module, prefix)
+            for var, value in collection.items():
+                self._store(module, var, _copy(value))
+            return collection
+
+    def get_collection(self, module: str) -> dict:
+        with self._lock:
+            cached = self._cached_collection(module)
+            if cached is not None:
+                return cached
+            collection = self._backend.get_collection(module)
+            self._fill_collection(module, collection)
+            return collection
+
+    async def aget(self, module: str, variable: str, default=None):
+        with self._lock:
+            value = self._lookup(module, variable)
+            self._count(module, value is not _UNKNOWN)
+            version = self._version(module)
+        if value is _UNKNOWN:
+            value = await self._backend.aget(module, variable, _MISSING)
+            with self._lock:
+                if self._version(module) == version:
+                    self._store(module, variable, value)
+        if value is _MISSING:
+            return default
+        return _copy(value)
+
+    async def aset(self, module: str, variable: str, value):
+        result = await self._backend.aset(module, variable, value)
+        with self._lock:
+            self._bump(module)
+            self._store(module, variable, _copy(value))
+        return result
+
+    async def aremove(self, module: str, variable: str):
+        await self._backend.aremove(module, variable)
+        with self._lock:
+            self._bump(module)
+            self._store(module, variable, _MISSING)
+
+    async def aget_collection(self, module: str) -> dict:
+        with self._lock:
+            cached = self._cached_collection(module)
+            version = self._version(module)
+        if cached is not None:
+            return cached
+        collection = await self._backend.aget_collection(module)
+        with self._lock:
+            if self._version(module) == version:
+                self._fill_collection(module, collection)
+        return collection
+
+    @contextmanager
+    def transaction(self):
+        try:
+            with self._backend.transaction():
+                yield self
+        except BaseException:
+            # Entries written inside the rolled back transaction are stale
+            self.invalidate()
+            raise
+
+    def flush(self):
+        self._backend.flush()
+
+    def ensure_indexes(self) -> int:
+        return self._backend.ensure_indexes()
+
+    def invalidate(self, module: str = None):
+        """Forget cached entries of one module, or of all modules"""
+        with self._lock:
+            if module is None:
+                self._generation += 1
+            else:
+                self._bump(module)
+            modules = [module] if module is not None else list(self._namespaces)
+            for name in modules:
+                for var in list(self._namespaces.pop(name, {})):
+                    self._lru.pop((name, var), None)
+                self._complete.pop(name, None)
+        for name in modules:
+            bus.publish(name)
+
+    def close(self):
+        self.invalidate()
+        self._backend.close()
 
 
 if config.db_type in ["mongo", "mongodb"]:
-    db = MongoDatabase(config.db_url, config.db_name)
+    _backend = MongoDatabase(config.db_url, config.db_name)
+else:
+    _backend = SqliteDatabase(
+        config.db_name,
+        journal_mode=config.db_journal_mode,
+        synchronous=config.db_synchronous,
+        commit_interval=config.db_group_commit_ms / 1000,
+        codec=config.db_value_codec,
+    )
+
+if config.db_cache_size > 0:
+    db = CachedDatabase(_backend, config.db_cache_size, config.db_cache_ttl)
 else:
-    db = SqliteDatabase(config.db_name)
+    db = _backend
@@ -14,14 +14,17 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import re
+import time
 from datetime import datetime, timedelta
 from typing import Dict, Union
 
 from pyrogram import Client
-from pyrogram.enums import ChatType
+from pyrogram.enums import ChatMemberStatus, ChatMembersFilter, ChatType
 from pyrogram.errors import (
     ChatAdminRequired,
+    FloodWait,
     PeerIdInvalid,
     RPCError,
     UserAdminInvalid,
@@ -31,10 +34,6 @@ from pyrogram.raw import functions, types
 from pyrogram.types import (
     ChatPermissions,
     ChatPrivileges,
-    InputMediaAudio,
-    InputMediaDocument,
-    InputMediaPhoto,
-    InputMediaVideo,
     Message,
 )
 from pyrogram.utils import (
@@ -42,11 +41,16 @@ from pyrogram.utils import (
     MAX_USER_ID,
     MIN_CHANNEL_ID,
     MIN_CHAT_ID,
-    get_channel_id,
 )
 
+from utils import config
+from utils.actions import BulkExecutor
 from utils.db import db
 from utils.misc import prefix
+from utils.names import names
+from utils.peers import peers
+from utils.reply_cache import reply_cache
+from utils.tmute import tmutes
 from utils.scripts import format_exc, text
 
 
@@ -86,6 +90,108 @@ async def get_user_and_name(message):
         )
 
 
+# ChatBannedRights of a ban and of a mute (pyrogram's ChatPermissions())
+BAN_RIGHTS = {
+    "view_messages": True,
+    "send_messages": True,
+    "send_media": True,
+    "send_stickers": True,
+    "send_gifs": True,
+    "send_games": True,
+    "send_inline": True,
+    "embed_links": True,
+}
+MUTE_RIGHTS = {
+    **BAN_RIGHTS,
+    "view_messages": False,
+    "send_polls": True,
+    "change_info": True,
+    "invite_users": True,
+    "pin_messages": True,
+}
+
+
+async def edit_banned(client: Client, chat, user_id: int, rights: dict, until: int = 0):
+    """Ban, restrict or (with no ``rights``) unban a member of ``chat``.
+
+    ``chat`` is the resolved input peer. The raw request is sent with
+    ``sleep_threshold=0`` so every FloodWait reaches the caller, e.g. a
+    :class:`BulkExecutor`, instead of being slept through by pyrogram.
+    Basic groups can only remove members, there is nothing to lift.
+    """
+    participant = await client.resolve_peer(user_id)
+    if isinstance(chat, types.InputPeerChannel):
+        query = functions.channels.EditBanned(
+            channel=chat,
+            participant=participant,
+            banned_rights=types.ChatBannedRights(until_date=until, **rights),
+        )
+    elif rights.get("view_messages"):
+        query = functions.messages.DeleteChatUser(
+            chat_id=chat.chat_id,
+            user_id=types.InputUser(
+                user_id=participant.user_id, access_hash=participant.access_hash
+            ),
+        )
+    elif rights:
+        raise ValueError("Members can only be restricted in supergroups")
+    else:
+        return
+    await client.invoke(query, sleep_threshold=0)
+
+
+async def delete_participant_history(
+    client: Client, channel, participant, wait_flood: bool = True, on_chunk=None
+) -> int:
+    """Delete all messages of a participant, returns how many were deleted.
+
+    The server deletes history in chunks and reports a non-zero ``offset``
+    while there is more, so the request is repeated until it's done.
+    FloodWait is slept through unless ``wait_flood`` is False, then it is
+    raised and a later call continues where this one stopped.
+    ``on_chunk(count)`` is called after every chunk.
+    """
+    deleted = 0
+    while True:
+        try:
+            affected = await client.invoke(
+                functions.channels.DeleteParticipantHistory(
+                    channel=channel, participant=participant
+                )
+            )
+        except FloodWait as e:
+            if not wait_flood:
+                raise
+            await asyncio.sleep(e.value)
+            continue
+        deleted += affected.pts_count
+        if on_chunk is not None:
+            on_chunk(affected.pts_count)
+        if not affected.offset:
+            return deleted
+
+
+DURATION = re.compile(r"^\d+(\.\d+)?[mhdw]$")
+
+
+def parse_duration(text_: str) -> int:
+    """Seconds of the 1m/1h/1d/1w parts of a command"""
+    seconds: int = 0
+    for character in "mhdw":
+        match = re.search(rf"(\d+|(\d+\.\d+)){character}", text_)
+        if match:
+            value = float(match.string[match.start() : match.end() - 1])
+            if character == "m":
+                seconds += int(value * 60)
+            if character == "h":
+                seconds += int(value * 3600)
+            if character == "d":
+                seconds += int(value * 86400)
+            if character == "w":
+                seconds += int(value * 604800)
+    return seconds
+
+
 class BanHandler:
     def __init__(self, client: Client, message: Message):
         self.client = client
@@ -127,7 +233,7 @@ class BanHandler:
         if user_type == "channel":
             return await self.client.get_chat(self.cause.split(" ")[1])
         if user_type == "user":
-            return await self.client.get_users(self.cause.split(" ")[1])
+            return await peers.get_user(self.client, self.cause.split(" ")[1])
         await self.message.edit("<b>Invalid user type</b>")
         return None
 
@@ -155,11 +261,7 @@ class BanHandler:
                 )
             )
         if "delete_history" in self.cause.lower().split():
-            await self.client.invoke(
-                functions.channels.DeleteParticipantHistory(
-                    channel=self.channel, participant=self.user_id
-                )
-            )
+            await delete_participant_history(self.client, self.channel, self.user_id)
 
     async def edit_message(self):
         text_c = "".join(
@@ -214,7 +316,7 @@ class UnbanHandler:
         if user_type == "channel":
             return await self.client.get_chat(self.cause.split(" ")[1])
         if user_type == "user":
-            return await self.client.get_users(self.cause.split(" ")[1])
+            return await peers.get_user(self.client, self.cause.split(" ")[1])
         await self.message.edit("<b>Invalid user type</b>")
         return None
 
@@ -287,7 +389,7 @@ class KickHandler:
         if user_type == "channel":
             return await self.client.get_chat(self.cause.split(" ")[1])
         if user_type == "user":
-            return await self.client.get_users(self.cause.split(" ")[1])
+            return await peers.get_user(self.client, self.cause.split(" ")[1])
         await self.message.edit("<b>Invalid user type</b>")
         return None
 
@@ -320,11 +422,7 @@ class KickHandler:
                 )
             )
         if "delete_history" in self.cause.lower().split():
-            await self.client.invoke(
-                functions.channels.DeleteParticipantHistory(
-                    channel=self.channel, participant=self.user_id
-                )
-            )
+            await delete_participant_history(self.client, self.channel, self.user_id)
 
     async def edit_message(self):
         text_c = "".join(
@@ -339,32 +437,181 @@ class KickHandler:
 
 
 class KickDeletedAccountsHandler:
+    """Kicks every deleted account of a chat.
+
+    Supergroup members are read with raw ``channels.GetParticipants`` pages
+    and deleted accounts are streamed to a :class:`BulkExecutor` while the
+    next pages load. The page offset is saved in ``core.kickdel`` so an
+    interrupted sweep resumes where it stopped (``restart`` starts over).
+    """
+
+    PAGE_SIZE = 200
+    RETRIES = 3
+
     def __init__(self, client: Client, message: Message):
         self.client = client
         self.message = message
         self.chat_id = message.chat.id
         self.kicked_count = 0
+        # deleted accounts that couldn't be kicked and stay in the list
+        self.failed_kicks = 0
+        self.flood_waits = {}
+        self.scanned = 0
+        self.started = datetime.now()
+        self.executor = BulkExecutor(config.bulk_concurrency, retries=self.RETRIES)
+        self.restart = len(message.command) > 1 and message.command[1] == "restart"
+        # pages read but not fully kicked yet, as [offset after page, pending]
+        self.pages = []
+        self.chat = None
 
     async def kick_deleted_accounts(self):
         await self.message.edit("<b>Kicking deleted accounts...</b>")
-        try:
-            async for member in self.client.get_chat_members(self.chat_id):
-                if member.user.is_deleted:
-                    await self.kick_member(member.user.id)
-                    self.kicked_count += 1
-        except Exception as e:
-            return await self.message.edit(format_exc(e))
-        await self.message.edit(
-            f"<b>Successfully kicked {self.kicked_count} deleted account(s)</b>",
+        self.chat = await peers.resolve_peer(self.client, self.chat_id)
+        if self.message.chat.type == ChatType.SUPERGROUP:
+            accounts = self.iter_channel_deleted()
+        else:
+            accounts = self.iter_chat_deleted()
+        summary = await self.executor.stream(accounts, self.kick_deleted, self.progress)
+        self.kicked_count = summary["done"]
+        if "error" in summary:
+            return await self.message.edit(
+                f"<b>Kicked {self.kicked_count} deleted account(s), then:</b>\n"
+                + format_exc(summary["error"])
+            )
+        db.remove("core.kickdel", str(self.chat_id))
+        text = (
+            f"<b>Successfully kicked {self.kicked_count} deleted account(s)</b>\n"
+            f"<b>Scanned</b> <code>{self.scanned}</code> <b>members in</b> "
+            f"<code>{summary['elapsed']:.1f}s</code>"
         )
+        if summary["errors"]:
+            text += "\n<b>Failed:</b> " + ", ".join(
+                f"<code>{name}</code>: {count}"
+                for name, count in summary["errors"].items()
+            )
+        await self.message.edit(text)
+
+    async def iter_chat_deleted(self):
+        async for member in self.client.get_chat_members(self.chat_id):
+            self.scanned += 1
+            if member.user.is_deleted:
+                yield None, member.user.id
+
+    async def iter_channel_deleted(self):
+        start = 0 if self.restart else db.get("core.kickdel", str(self.chat_id), 0)
+        if start:
+            await self.message.edit(
+                f"<b>Resuming from member</b> <code>{start}</code>..."
+            )
+        seen = set()
+        # Kicked accounts leave the list and shift later members back, so the
+        # offset only counts the members that stay: those seen and not
+        # deleted, plus deleted ones whose kick failed. While kicks lag
+        # behind, pages overlap members already seen, which are skipped.
+        kept = 0
+        while True:
+            page = await self.get_participants(
+                self.chat, start + kept + self.failed_kicks
+            )
+            if not page.participants:
+                break
+            members = {getattr(p, "user_id", None) for p in page.participants}
+            users = [user for user in page.users if user.id in members]
+            new = [user for user in users if user.id not in seen]
+            if not new:
+                if self.pending_kicks():
+                    # only seen members: wait for the lagging kicks to land
+                    while self.pending_kicks():
+                        await asyncio.sleep(1)
+                else:
+                    # the member list changed meanwhile, step over the page
+                    start += len(page.participants)
+                continue
+            self.scanned += len(new)
+            deleted = [user.id for user in new if user.deleted]
+            seen.update(user.id for user in new)
+            kept += len(new) - len(deleted)
+            entry = [start + kept + self.failed_kicks, len(deleted)]
+            self.pages.append(entry)
+            if deleted:
+                for user_id in deleted:
+                    yield entry, user_id
+            else:
+                self.save_checkpoint()
+
+    def pending_kicks(self) -> bool:
+        return any(pending for _, pending in self.pages)
+
+    def save_checkpoint(self):
+        """Save the offset after the last page whose kicks are all done.
+
+        The offset is only right once the page's deleted accounts are gone,
+        so pages still being kicked (and the ones after them) wait.
+        """
+        offset = None
+        while self.pages and not self.pages[0][1]:
+            offset = self.pages.pop(0)[0]
+        if offset is not None:
+            db.set("core.kickdel", str(self.chat_id), offset)
+
+    async def kick_deleted(self, target: tuple):
+        page, user_id = target
+        try:
+            await self.kick_member(user_id)
+        except FloodWait:
+            # retried by the executor until it gives up after RETRIES waits
+            self.flood_waits[user_id] = self.flood_waits.get(user_id, 0) + 1
+            if self.flood_waits[user_id] > self.RETRIES:
+                self.kick_failed(page)
+            raise
+        except Exception:
+            self.kick_failed(page)
+            raise
+        self.page_done(page)
+
+    def kick_failed(self, page):
+        self.failed_kicks += 1
+        self.page_done(page)
+
+    def page_done(self, page):
+        if page is not None:
+            page[1] -= 1
+            self.save_checkpoint()
+
+    async def get_participants(self, channel, offset: int):
+        while True:
+            try:
+                return await self.client.invoke(
+                    functions.channels.GetParticipants(
+                        channel=channel,
+                        filter=types.ChannelParticipantsRecent(),
+                        offset=offset,
+                        limit=self.PAGE_SIZE,
+                        hash=0,
+                    )
+                )
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
 
     async def kick_member(self, user_id):
+        # raw, so every FloodWait reaches the executor instead of being slept
+        await edit_banned(
+            self.client, self.chat, user_id, BAN_RIGHTS, int(time.time()) + 31
+        )
+
+    async def progress(self, done: int, total: int):
+        elapsed = max((datetime.now() - self.started).total_seconds(), 1)
         try:
-            await self.client.ban_chat_member(
-                self.chat_id, user_id, datetime.now() + timedelta(seconds=31)
+            await self.message.edit(
+                "<b>Kicking deleted accounts...</b>\n"
+                f"<b>Scanned:</b> <code>{self.scanned}</code> "
+                f"(<code>{self.scanned / elapsed:.0f}/s</code>)\n"
+                f"<b>Kicked:</b> <code>{done}/{total}</code> "
+                f"(<code>{done / elapsed:.1f}/s</code>, "
+                f"<code>{self.executor.limit}</code> at once)"
             )
-        except Exception as e:
-            await self.message.edit(f"Failed to kick user {user_id}: {format_exc(e)}")
+        except RPCError:
+            pass
 
 
 class TimeMuteHandler:
@@ -373,7 +620,14 @@ class TimeMuteHandler:
         self.message = message
         self.cause = text(message)
         self.chat_id = message.chat.id
-        self.tmuted_users = db.get("core.ats", f"c{self.chat_id}", [])
+        self.seconds = 0
+        # only a trailing 1m/1h/1d/1w argument is a duration, after the target
+        args = self.cause.split()
+        if len(args) > (1 if message.reply_to_message else 2) and DURATION.match(
+            args[-1]
+        ):
+            self.seconds = parse_duration(args[-1])
+            self.cause = self.cause.rsplit(maxsplit=1)[0]
 
     async def handle_tmute(self):
         if self.message.reply_to_message:
@@ -386,13 +640,11 @@ class TimeMuteHandler:
     async def handle_reply_tmute(self):
         if self.message.chat.type not in [ChatType.PRIVATE, ChatType.CHANNEL]:
             user_for_tmute, name = await get_user_and_name(self.message)
-            if user_for_tmute in self.tmuted_users:
+            if not tmutes.add(self.chat_id, user_for_tmute, self.seconds):
                 await self.message.edit(f"<b>{name}</b> <code>already in tmute</code>")
             else:
-                self.tmuted_users.append(user_for_tmute)
-                db.set("core.ats", f"c{self.chat_id}", self.tmuted_users)
                 await self.message.edit(
-                    f"<b>{name}</b> <code>in tmute</code>"
+                    f"<b>{name}</b> <code>in tmute{self.duration_text()}</code>"
                     + f"\n{'<b>Cause:</b> <i>' + self.cause.split(maxsplit=1)[1] + '</i>' if len(self.cause.split()) > 1 else ''}",
                 )
 
@@ -406,11 +658,9 @@ class TimeMuteHandler:
                         if getattr(user_to_tmute, "first_name", None)
                         else user_to_tmute.title
                     )
-                    if user_to_tmute.id not in self.tmuted_users:
-                        self.tmuted_users.append(user_to_tmute.id)
-                        db.set("core.ats", f"c{self.chat_id}", self.tmuted_users)
+                    if tmutes.add(self.chat_id, user_to_tmute.id, self.seconds):
                         await self.message.edit(
-                            f"<b>{name}</b> <code>in tmute</code>"
+                            f"<b>{name}</b> <code>in tmute{self.duration_text()}</code>"
                             + f"\n{'<b>Cause:</b> <i>' + self.cause.split(maxsplit=2)[2] + '</i>' if len(self.cause.split()) > 2 else ''}",
                         )
                     else:
@@ -420,12 +670,17 @@ class TimeMuteHandler:
             else:
                 await self.message.edit("<b>user_id or username</b>")
 
+    def duration_text(self):
+        if not self.seconds:
+            return ""
+        return f" for {timedelta(seconds=self.seconds)}"
+
     async def get_user_to_tmute(self):
         user_type = await check_username_or_id(self.cause.split(" ")[1])
         if user_type == "channel":
             return await self.client.get_chat(self.cause.split(" ")[1])
         if user_type == "user":
-            return await self.client.get_users(self.cause.split(" ")[1])
+            return await peers.get_user(self.client, self.cause.split(" ")[1])
         await self.message.edit("<b>Invalid user type</b>")
         return None
 
@@ -436,7 +691,6 @@ class TimeUnmuteHandler:
         self.message = message
         self.cause = text(message)
         self.chat_id = message.chat.id
-        self.tmuted_users = db.get("core.ats", f"c{self.chat_id}", [])
 
     async def handle_tunmute(self):
         if self.message.reply_to_message:
@@ -449,11 +703,9 @@ class TimeUnmuteHandler:
     async def handle_reply_tunmute(self):
         if self.message.chat.type not in [ChatType.PRIVATE, ChatType.CHANNEL]:
             user_for_tunmute, name = await get_user_and_name(self.message)
-            if user_for_tunmute not in self.tmuted_users:
+            if not tmutes.remove(self.chat_id, user_for_tunmute):
                 await self.message.edit(f"<b>{name}</b> <code>not in tmute</code>")
             else:
-                self.tmuted_users.remove(user_for_tunmute)
-                db.set("core.ats", f"c{self.chat_id}", self.tmuted_users)
                 await self.message.edit(
                     f"<b>{name}</b> <code>tunmuted</code>"
                     + f"\n{'<b>Cause:</b> <i>' + self.cause.split(maxsplit=1)[1] + '</i>' if len(self.cause.split()) > 1 else ''}",
@@ -469,13 +721,11 @@ class TimeUnmuteHandler:
                         if getattr(user_to_tunmute, "first_name", None)
                         else user_to_tunmute.title
                     )
-                    if user_to_tunmute.id not in self.tmuted_users:
+                    if not tmutes.remove(self.chat_id, user_to_tunmute.id):
                         await self.message.edit(
                             f"<b>{name}</b> <code>not in tmute</code>",
                         )
                     else:
-                        self.tmuted_users.remove(user_to_tunmute.id)
-                        db.set("core.ats", f"c{self.chat_id}", self.tmuted_users)
                         await self.message.edit(
                             f"<b>{name}</b> <code>tunmuted</code>"
                             + f"\n{'<b>Cause:</b> <i>' + self.cause.split(maxsplit=2)[2] + '</i>' if len(self.cause.split()) > 2 else ''}",
@@ -488,7 +738,7 @@ class TimeUnmuteHandler:
         if user_type == "channel":
             return await self.client.get_chat(self.cause.split(" ")[1])
         if user_type == "user":
-            return await self.client.get_users(self.cause.split(" ")[1])
+            return await peers.get_user(self.client, self.cause.split(" ")[1])
         await self.message.edit("<b>Invalid user type</b>")
         return None
 
@@ -498,20 +748,19 @@ class TimeMuteUsersHandler:
         self.client = client
         self.message = message
         self.chat_id = message.chat.id
-        self.tmuted_users = db.get("core.ats", f"c{self.chat_id}", [])
+        self.tmuted_users = tmutes.users(self.chat_id)
 
     async def list_tmuted_users(self):
         if self.message.chat.type not in [ChatType.PRIVATE, ChatType.CHANNEL]:
             text = f"<b>All users</b> <code>{self.message.chat.title}</code> <b>who are now in tmute</b>\n\n"
+            user_names = await names.get_names(self.client, self.tmuted_users)
             count = 0
             for user in self.tmuted_users:
-                try:
-                    name = await self.get_user_name(user)
-                    if name:
-                        count += 1
-                        text += f"{count}. <b>{name}</b>\n"
-                except PeerIdInvalid:
-                    pass
+                count += 1
+                if user in user_names:
+                    text += f"{count}. <b>{user_names[user]}</b>\n"
+                else:
+                    text += f"{count}. <code>{user}</code>\n"
             if count == 0:
                 await self.message.edit("<b>No users in tmute</b>")
             else:
@@ -520,27 +769,6 @@ class TimeMuteUsersHandler:
         else:
             await self.message.edit("<b>Unsupported</b>")
 
-    async def get_user_name(self, user_id):
-        try:
-            _name_ = await self.client.get_chat(user_id)
-            if await check_username_or_id(_name_.id) == "channel":
-                channel = await self.client.invoke(
-                    functions.channels.GetChannels(
-                        id=[
-                            types.InputChannel(
-                                channel_id=get_channel_id(_name_.id),
-                                access_hash=0,
-                            )
-                        ]
-                    )
-                )
-                return channel.chats[0].title
-            if await check_username_or_id(_name_.id) == "user":
-                user = await self.client.get_users(_name_.id)
-                return user.first_name
-        except PeerIdInvalid:
-            return None
-
 
 class UnmuteHandler:
     def __init__(self, client: Client, message: Message):
@@ -604,7 +832,7 @@ class UnmuteHandler:
         if user_type == "channel":
             return await self.client.get_chat(self.cause.split(" ")[1])
         if user_type == "user":
-            return await self.client.get_users(self.cause.split(" ")[1])
+            return await peers.get_user(self.client, self.cause.split(" ")[1])
         await self.message.edit("<b>Invalid user type</b>")
         return None
 
@@ -681,25 +909,12 @@ class MuteHandler:
         if user_type == "channel":
             return await self.client.get_chat(self.cause.split(" ")[1])
         if user_type == "user":
-            return await self.client.get_users(self.cause.split(" ")[1])
+            return await peers.get_user(self.client, self.cause.split(" ")[1])
         await self.message.edit("<b>Invalid user type</b>")
         return None
 
     def calculate_mute_seconds(self):
-        mute_seconds: int = 0
-        for character in "mhdw":
-            match = re.search(rf"(\d+|(\d+\.\d+)){character}", self.message.text)
-            if match:
-                value = float(match.string[match.start() : match.end() - 1])
-                if character == "m":
-                    mute_seconds += int(value * 60)
-                if character == "h":
-                    mute_seconds += int(value * 3600)
-                if character == "d":
-                    mute_seconds += int(value * 86400)
-                if character == "w":
-                    mute_seconds += int(value * 604800)
-        return mute_seconds
+        return parse_duration(self.message.text)
 
     async def mute_user(self, user_id, mute_seconds):
         try:
@@ -808,7 +1023,7 @@ class DemoteHandler:
         if user_type == "channel":
             return await self.client.get_chat(self.cause.split(" ")[1])
         if user_type == "user":
-            return await self.client.get_users(self.cause.split(" ")[1])
+            return await peers.get_user(self.client, self.cause.split(" ")[1])
         await self.message.edit("<b>Invalid user type</b>")
         return None
 
@@ -912,7 +1127,7 @@ class PromoteHandler:
         if user_type == "channel":
             return await self.client.get_chat(self.cause.split(" ")[1])
         if user_type == "user":
-            return await self.client.get_users(self.cause.split(" ")[1])
+            return await peers.get_user(self.client, self.cause.split(" ")[1])
         await self.message.edit("<b>Invalid user type</b>")
         return None
 
@@ -978,12 +1193,16 @@ class AntiChannelsHandler:
             await self.message.edit("<b>Blocking channels in this chat disabled.</b>")
 
     async def enable_anti_channels(self):
-        db.set("core.ats", f"antich{self.chat_id}", True)
         group = await self.client.get_chat(self.chat_id)
-        if group.linked_chat:
-            db.set("core.ats", f"linked{self.chat_id}", group.linked_chat.id)
-        else:
-            db.set("core.ats", f"linked{self.chat_id}", 0)
+        db.set_many(
+            "core.ats",
+            {
+                f"antich{self.chat_id}": True,
+                f"linked{self.chat_id}": (
+                    group.linked_chat.id if group.linked_chat else 0
+                ),
+            },
+        )
         await self.message.edit("<b>Blocking channels in this chat enabled.</b>")
 
     async def disable_anti_channels(self):
@@ -998,6 +1217,7 @@ class DeleteHistoryHandler:
         self.cause = text(message)
         self.chat_id = message.chat.id
         self.prefix = prefix
+        self.deleted = 0
 
     async def handle_delete_history(self):
         if self.message.chat.type not in [ChatType.PRIVATE, ChatType.CHANNEL]:
@@ -1010,29 +1230,22 @@ class DeleteHistoryHandler:
 
     async def handle_reply_delete_history(self):
         if self.message.reply_to_message.from_user:
-            try:
-                user_for_delete, name = await get_user_and_name(self.message)
-                await self.delete_user_history(user_for_delete, name)
-            except UserAdminInvalid:
-                await self.message.edit("<b>No rights</b>")
-            except ChatAdminRequired:
-                await self.message.edit("<b>No rights</b>")
-            except Exception as e:
-                await self.message.edit(format_exc(e))
+            user_for_delete, name = await get_user_and_name(self.message)
+            await self.delete_user_history(user_for_delete, name)
         else:
             await self.message.edit("<b>Reply on user msg</b>")
 
     async def handle_non_reply_delete_history(self):
         if len(self.cause.split()) > 1:
             try:
-                user_to_delete = await self.get_user_to_delete()
-                if user_to_delete:
-                    name = (
-                        user_to_delete.first_name
-                        if getattr(user_to_delete, "first_name", None)
-                        else user_to_delete.title
+                users_to_delete = await self.get_users_to_delete()
+                if users_to_delete:
+                    await self.delete_users_history(
+                        {
+                            user.id: getattr(user, "first_name", None) or user.title
+                            for user in users_to_delete
+                        }
                     )
-                    await self.delete_user_history(user_to_delete.id, name)
                 else:
                     await self.message.edit("<b>User is not found</b>")
             except PeerIdInvalid:
@@ -1044,34 +1257,70 @@ class DeleteHistoryHandler:
         else:
             await self.message.edit("<b>user_id or username</b>")
 
-    async def get_user_to_delete(self):
-        user_type = await check_username_or_id(self.cause.split(" ")[1])
-        if user_type == "channel":
-            return await self.client.get_chat(self.cause.split(" ")[1])
-        if user_type == "user":
-            return await self.client.get_users(self.cause.split(" ")[1])
-        await self.message.edit("<b>Invalid user type</b>")
-        return None
+    async def get_users_to_delete(self) -> list:
+        """Users/channels from the comma separated first argument"""
+        users = []
+        for peer in filter(None, self.cause.split(" ")[1].split(",")):
+            user_type = await check_username_or_id(peer)
+            if user_type == "channel":
+                users.append(await self.client.get_chat(peer))
+            elif user_type == "user":
+                users.append(await peers.get_user(self.client, peer))
+            else:
+                await self.message.edit("<b>Invalid user type</b>")
+                return []
+        return users
 
     async def delete_user_history(self, user_id, name):
+        await self.delete_users_history({user_id: name})
+
+    async def delete_users_history(self, users: dict):
+        """Delete the history of ``user_id -> name``, several users at once"""
         try:
-            channel = await self.client.resolve_peer(self.chat_id)
-            user_id = await self.client.resolve_peer(user_id)
-            await self.client.invoke(
-                functions.channels.DeleteParticipantHistory(
-                    channel=channel, participant=user_id
-                )
+            channel = await peers.resolve_peer(self.client, self.chat_id)
+        except Exception as e:
+            return await self.message.edit(format_exc(e))
+
+        def count(deleted: int):
+            self.deleted += deleted
+
+        async def delete(user_id):
+            participant = await self.client.resolve_peer(user_id)
+            # FloodWait goes to the executor, which pauses every worker
+            await delete_participant_history(
+                self.client, channel, participant, wait_flood=False, on_chunk=count
             )
+
+        if len(users) > 1:
             await self.message.edit(
-                f"<code>History from <b>{name}</b> was deleted!</code>"
-                + f"\n{'<b>Cause:</b> <i>' + self.cause.split(' ', maxsplit=1)[1] + '</i>' if len(self.cause.split()) > 1 else ''}"
+                f"<b>Deleting history of</b> <code>{len(users)}</code> <b>users...</b>"
             )
-        except UserAdminInvalid:
-            await self.message.edit("<b>No rights</b>")
-        except ChatAdminRequired:
-            await self.message.edit("<b>No rights</b>")
-        except Exception as e:
-            await self.message.edit(format_exc(e))
+        summary = await BulkExecutor(config.bulk_concurrency).run(
+            list(users), delete, self.progress
+        )
+        errors = summary["errors"]
+        if "UserAdminInvalid" in errors or "ChatAdminRequired" in errors:
+            return await self.message.edit("<b>No rights</b>")
+        if errors:
+            return await self.message.edit(
+                "<b>Failed:</b> "
+                + ", ".join(f"<code>{name}</code>: {count}" for name, count in errors.items())
+            )
+        titles = ", ".join(f"<b>{name}</b>" for name in users.values())
+        await self.message.edit(
+            f"<code>History from {titles} was deleted!</code> "
+            f"(<code>{self.deleted}</code> messages)"
+            + f"\n{'<b>Cause:</b> <i>' + self.cause.split(' ', maxsplit=1)[1] + '</i>' if len(self.cause.split()) > 1 else ''}"
+        )
+
+    async def progress(self, done: int, total: int):
+        try:
+            await self.message.edit(
+                f"<b>Deleting history...</b> <code>{done}/{total}</code> "
+                f"<b>users,</b> <code>{self.deleted}</code> <b>messages</b>"
+            )
+        except RPCError:
+            pass
 
 
 class AntiRaidHandler:
@@ -1092,12 +1341,16 @@ class AntiRaidHandler:
             await self.toggle_antiraid()
 
     async def enable_antiraid(self):
-        db.set("core.ats", f"antiraid{self.chat_id}", True)
         group = await self.client.get_chat(self.chat_id)
-        if group.linked_chat:
-            db.set("core.ats", f"linked{self.chat_id}", group.linked_chat.id)
-        else:
-            db.set("core.ats", f"linked{self.chat_id}", 0)
+        db.set_many(
+            "core.ats",
+            {
+                f"antiraid{self.chat_id}": True,
+                f"linked{self.chat_id}": (
+                    group.linked_chat.id if group.linked_chat else 0
+                ),
+            },
+        )
         await self.message.edit(
             "<b>Anti-raid mode enabled!\n"
             f"Disable with: </b><code>{self.prefix}antiraid off</code>"
@@ -1110,18 +1363,23 @@ class AntiRaidHandler:
     async def toggle_antiraid(self):
         current_status = db.get("core.ats", f"antiraid{self.chat_id}", False)
         new_status = not current_status
-        db.set("core.ats", f"antiraid{self.chat_id}", new_status)
         if new_status:
             group = await self.client.get_chat(self.chat_id)
-            if group.linked_chat:
-                db.set("core.ats", f"linked{self.chat_id}", group.linked_chat.id)
-            else:
-                db.set("core.ats", f"linked{self.chat_id}", 0)
+            db.set_many(
+                "core.ats",
+                {
+                    f"antiraid{self.chat_id}": new_status,
+                    f"linked{self.chat_id}": (
+                        group.linked_chat.id if group.linked_chat else 0
+                    ),
+                },
+            )
             await self.message.edit(
                 "<b>Anti-raid mode enabled!\n"
                 f"Disable with: </b><code>{self.prefix}antiraid off</code>"
             )
         else:
+            db.set("core.ats", f"antiraid{self.chat_id}", new_status)
             await self.message.edit("<b>Anti-raid mode disabled</b>")
 
 
@@ -1141,7 +1399,7 @@ class NoteSendHandler:
             if find_note:
                 try:
                     await self.send_note(find_note)
-                except RPCError:
+                except (RPCError, ValueError):
                     await self.message.edit(
                         "<b>Sorry, but this note is unavailable.\n\n"
                         f"You can delete this note with "
@@ -1155,97 +1413,172 @@ class NoteSendHandler:
             )
 
     async def send_note(self, find_note):
-        if find_note.get("MEDIA_GROUP"):
-            await self.message.delete()
-            await self.send_media_group(find_note)
-        else:
-            await self.message.delete()
-            await self.copy_message(find_note)
-
-    async def send_media_group(self, find_note):
-        messages_grouped = await self.client.get_media_group(
-            int(find_note["CHAT_ID"]), int(find_note["MESSAGE_ID"])
+        await self.message.delete()
+        reply_to = self.message.reply_to_message
+        await reply_cache.send(
+            self.client,
+            self.message.chat.id,
+            find_note,
+            reply_to_message_id=reply_to.id if reply_to else None,
         )
-        media_grouped_list = self.prepare_media_group(messages_grouped)
-        if self.message.reply_to_message:
-            await self.client.send_media_group(
-                self.message.chat.id,
-                media_grouped_list,
-                reply_to_message_id=self.message.reply_to_message.id,
-            )
-        else:
-            await self.client.send_media_group(self.message.chat.id, media_grouped_list)
 
-    async def copy_message(self, find_note):
-        if self.message.reply_to_message:
-            await self.client.copy_message(
-                self.message.chat.id,
-                int(find_note["CHAT_ID"]),
-                int(find_note["MESSAGE_ID"]),
-                reply_to_message_id=self.message.reply_to_message.id,
+
+class BulkModerationHandler:
+    """Ban, kick or mute many users with one command.
+
+    Targets are ids/usernames from the command, and/or every member who
+    joined in the last ``--joined`` minutes/hours. User ids are resolved
+    in batches of 100, usernames concurrently, and the restrictions run
+    through a :class:`BulkExecutor`.
+    """
+
+    ACTIONS = {"ban": "banned", "kick": "kicked", "mute": "muted"}
+
+    def __init__(self, client: Client, message: Message, action: str):
+        self.client = client
+        self.message = message
+        self.action = action
+        self.chat_id = message.chat.id
+        self.executor = BulkExecutor(config.bulk_concurrency)
+        self.joined = 0
+        self.mute_seconds = 0
+        self.tokens = []
+        self.unresolved = []
+        self.chat = None
+        self.parse_args(message.command[1:])
+
+    def parse_args(self, args: list):
+        args = iter(args)
+        for arg in args:
+            if arg == "--joined":
+                self.joined = parse_duration(next(args, ""))
+            elif arg == "--for":
+                self.mute_seconds = parse_duration(next(args, ""))
+            else:
+                self.tokens.extend(filter(None, arg.split(",")))
+
+    async def handle(self):
+        if self.message.chat.type in [ChatType.PRIVATE, ChatType.CHANNEL]:
+            return await self.message.edit("<b>Unsupported</b>")
+        if not self.tokens and not self.joined:
+            return await self.message.edit(
+                f"<b>Usage:</b> <code>{prefix}b{self.action} "
+                "[id/username ...] [--joined 10m]</code>"
             )
-        else:
-            await self.client.copy_message(
-                self.message.chat.id,
-                int(find_note["CHAT_ID"]),
-                int(find_note["MESSAGE_ID"]),
+
+        await self.message.edit("<b>Resolving targets...</b>")
+        targets = await self.resolve_targets()
+        if self.joined:
+            targets.update(await self.recent_members(self.joined))
+        targets.discard((await peers.get_me(self.client)).id)
+        if not targets:
+            return await self.message.edit(
+                "<b>No users found</b>" + self.format_unresolved()
             )
 
-    def prepare_media_group(self, messages_grouped):
-        media_grouped_list = []
-        for _ in messages_grouped:
-            if _.photo:
-                media_grouped_list.append(self.prepare_photo(_))
-            elif _.video:
-                media_grouped_list.append(self.prepare_video(_))
-            elif _.audio:
-                media_grouped_list.append(self.prepare_audio(_))
-            elif _.document:
-                media_grouped_list.append(self.prepare_document(_))
-        return media_grouped_list
-
-    @staticmethod
-    def prepare_photo(message):
-        if message.caption:
-            return InputMediaPhoto(message.photo.file_id, message.caption.markdown)
-        return InputMediaPhoto(message.photo.file_id)
-
-    @staticmethod
-    def prepare_video(message):
-        if message.caption:
-            if message.video.thumbs:
-                return InputMediaVideo(
-                    message.video.file_id,
-                    message.video.thumbs[0].file_id,
-                    message.caption.markdown,
+        self.chat = await peers.resolve_peer(self.client, self.chat_id)
+        summary = await self.executor.run(
+            list(targets), getattr(self, f"{self.action}_user"), self.progress
+        )
+        summary["total"] += len(self.unresolved)
+        summary["failed"] += len(self.unresolved)
+        await self.message.edit(self.format_summary(summary))
+
+    async def resolve_targets(self) -> set:
+        targets = set()
+        user_ids = []
+        usernames = []
+        for token in self.tokens:
+            if token.lstrip("-").isdigit():
+                peer_id = int(token)
+                if peer_id > 0:
+                    user_ids.append(peer_id)
+                else:
+                    targets.add(peer_id)
+            else:
+                usernames.append(token)
+
+        for i in range(0, len(user_ids), 100):
+            chunk = user_ids[i : i + 100]
+            try:
+                users = await peers.get_users(self.client, chunk)
+            except RPCError:
+                # unknown ids can still be restricted if the session knows them
+                targets.update(chunk)
+            else:
+                found = {user.id for user in users}
+                targets.update(found)
+                self.unresolved.extend(
+                    str(user_id) for user_id in chunk if user_id not in found
                 )
-            return InputMediaVideo(message.video.file_id, message.caption.markdown)
-        if message.video.thumbs:
-            return InputMediaVideo(
-                message.video.file_id, message.video.thumbs[0].file_id
+
+        resolved = set()
+
+        async def resolve(username):
+            chat = await self.client.get_chat(username)
+            targets.add(chat.id)
+            resolved.add(username)
+
+        if usernames:
+            await self.executor.run(usernames, resolve)
+            self.unresolved.extend(
+                username for username in usernames if username not in resolved
             )
-        return InputMediaVideo(message.video.file_id)
-
-    @staticmethod
-    def prepare_audio(message):
-        if message.caption:
-            return InputMediaAudio(message.audio.file_id, message.caption.markdown)
-        return InputMediaAudio(message.audio.file_id)
-
-    @staticmethod
-    def prepare_document(message):
-        if message.caption:
-            if message.document.thumbs:
-                return InputMediaDocument(
-                    message.document.file_id,
-                    message.document.thumbs[0].file_id,
-                    message.caption.markdown,
-                )
-            return InputMediaDocument(
-                message.document.file_id, message.caption.markdown
+        return targets
+
+    async def recent_members(self, seconds: int) -> set:
+        """Members who joined in the last ``seconds``, newest first"""
+        cutoff = datetime.now() - timedelta(seconds=seconds)
+        members = set()
+        async for member in self.client.get_chat_members(
+            self.chat_id, filter=ChatMembersFilter.RECENT
+        ):
+            if member.joined_date and member.joined_date < cutoff:
+                break
+            if member.user and member.status not in [
+                ChatMemberStatus.OWNER,
+                ChatMemberStatus.ADMINISTRATOR,
+            ]:
+                members.add(member.user.id)
+        return members
+
+    async def ban_user(self, user_id: int):
+        await edit_banned(self.client, self.chat, user_id, BAN_RIGHTS)
+
+    async def kick_user(self, user_id: int):
+        await edit_banned(self.client, self.chat, user_id, BAN_RIGHTS)
+        await edit_banned(self.client, self.chat, user_id, {})
+
+    async def mute_user(self, user_id: int):
+        # Telegram treats restrictions under 30 seconds as forever anyway
+        until = int(time.time()) + self.mute_seconds if self.mute_seconds > 30 else 0
+        await edit_banned(self.client, self.chat, user_id, MUTE_RIGHTS, until)
+
+    async def progress(self, done: int, total: int):
+        try:
+            await self.message.edit(
+                f"<b>{self.ACTIONS[self.action].capitalize()}</b> "
+                f"<code>{done}/{total}</code>..."
             )
-        if message.document.thumbs:
-            return InputMediaDocument(
-                message.document.file_id, message.document.thumbs[0].file_id
+        except RPCError:
+            pass
+
+    def format_summary(self, summary: dict) -> str:
+        text = (
+            f"<b>{self.ACTIONS[self.action].capitalize()}</b> "
+            f"<code>{summary['done']}/{summary['total']}</code> "
+            f"<b>users in</b> <code>{summary['elapsed']:.1f}s</code>"
+        )
+        if summary["errors"]:
+            text += "\n<b>Failed:</b>\n" + "\n".join(
+                f"• <code>{name}</code>: {count}"
+                for name, count in summary["errors"].items()
             )
-        return InputMediaDocument(message.document.file_id)
+        return text + self.format_unresolved()
+
+    def format_unresolved(self) -> str:
+        if not self.unresolved:
+            return ""
+        return "\n<b>Not found:</b> " + ", ".join(
+            f"<code>{token}</code>" for token in self.unresolved
+        )
@@ -0,0 +1,94 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+from collections import OrderedDict
+
+from utils.db import db
+
+
+class WarningLedger:
+    """Per-user warning counters that survive restarts.
+
+    Kept in memory as ``user_id -> [count, last warning time]`` ordered by
+    last warning, stored in the database as one value a few seconds after
+    a change. At most ``max_size`` users are kept, and a user's warnings
+    expire ``ttl`` seconds after the last one.
+    """
+
+    def __init__(
+        self,
+        module: str,
+        variable: str = "warnings",
+        max_size: int = 1000,
+        ttl: float = 86400,
+        save_delay: float = 5,
+    ):
+        self._module = module
+        self._variable = variable
+        self._max_size = max_size
+        self._ttl = ttl
+        self._save_delay = save_delay
+        self._save_handle = None
+        self._entries = OrderedDict(
+            (int(user_id), entry)
+            for user_id, entry in sorted(
+                db.get(module, variable, {}).items(), key=lambda item: item[1][1]
+            )
+        )
+        self._expire(time.time())
+
+    def get(self, user_id: int) -> int:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[1] + self._ttl < time.time():
+            return 0
+        return entry[0]
+
+    def warn(self, user_id: int) -> int:
+        """Add a warning, returns the new count"""
+        now = time.time()
+        count = self.get(user_id) + 1
+        self._entries[user_id] = [count, now]
+        self._entries.move_to_end(user_id)
+        self._expire(now)
+        self._schedule_save()
+        return count
+
+    def reset(self, user_id: int):
+        if self._entries.pop(user_id, None) is not None:
+            self._schedule_save()
+
+    def _expire(self, now: float):
+        while self._entries:
+            user_id, (_, last) = next(iter(self._entries.items()))
+            if len(self._entries) <= self._max_size and last + self._ttl >= now:
+                break
+            del self._entries[user_id]
+
+    def _schedule_save(self):
+        if self._save_handle is None:
+            self._save_handle = asyncio.get_running_loop().call_later(
+                self._save_delay, self.save
+            )
+
+    def save(self):
+        self._save_handle = None
+        db.set(
+            self._module,
+            self._variable,
+            {str(user_id): entry for user_id, entry in self._entries.items()},
+        )
@@ -0,0 +1,181 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+from collections import OrderedDict
+
+from pyrogram.types import Message
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _extension(media) -> str:
+    file_name = getattr(media, "file_name", None)
+    if file_name and "." in file_name:
+        return os.path.splitext(file_name)[1]
+    mime_type = getattr(media, "mime_type", None)
+    if mime_type:
+        return mimetypes.guess_extension(mime_type) or ""
+    return ".jpg" if media.__class__.__name__ == "Photo" else ""
+
+
+class MediaDownloader:
+    """Background, deduplicated media downloads for logged messages.
+
+    Files are fetched by a bounded pool of workers and stored under
+    ``root/<sha[:2]>/<sha><ext>``. ``root/by-id/<file_unique_id>`` points at the
+    stored file, so the same Telegram file is downloaded only once, even
+    across restarts.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        workers: int = 3,
+        max_queue: int = 100,
+        max_size: int = 20 * 1024 * 1024,
+        cache_size: int = 4096,
+    ):
+        self._root = root
+        self._workers_count = max(1, workers)
+        self._max_size = max_size
+        self._cache_size = cache_size
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._known = OrderedDict()
+        self._pending = set()
+        self._workers = []
+        self.stats = {
+            "queued": 0,
+            "downloaded": 0,
+            "deduplicated": 0,
+            "skipped": 0,
+            "dropped": 0,
+            "failed": 0,
+        }
+        for sub in ("by-id", "tmp"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        while len(self._workers) < self._workers_count:
+            self._workers.append(loop.create_task(self._worker()))
+
+    async def close(self):
+        """Stop the workers, downloads still in the queue are abandoned"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    def lookup(self, file_unique_id: str) -> str | None:
+        """Return the stored path of an already downloaded file"""
+        if file_unique_id in self._known:
+            self._known.move_to_end(file_unique_id)
+            return self._known[file_unique_id]
+        marker = os.path.join(self._root, "by-id", file_unique_id)
+        try:
+            with open(marker, encoding="utf-8") as f:
+                path = f.read().strip()
+        except OSError:
+            return None
+        if not os.path.exists(path):
+            return None
+        self._remember(file_unique_id, path)
+        return path
+
+    def submit(self, message: Message) -> str | None:
+        """Schedule the media of a message for download without waiting on it.
+
+        Returns the ``file_unique_id`` of the media, or None if the message
+        has no downloadable file or it was skipped.
+        """
+        media = getattr(message, message.media.value, None) if message.media else None
+        file_unique_id = getattr(media, "file_unique_id", None)
+        if not file_unique_id:
+            return None
+
+        if file_unique_id in self._pending or self.lookup(file_unique_id):
+            self.stats["deduplicated"] += 1
+            return file_unique_id
+
+        if (getattr(media, "file_size", None) or 0) > self._max_size:
+            self.stats["skipped"] += 1
+            return None
+
+        try:
+            self._queue.put_nowait((file_unique_id, _extension(media), message))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            return None
+        self._pending.add(file_unique_id)
+        self.stats["queued"] += 1
+        return file_unique_id
+
+    def _remember(self, file_unique_id: str, path: str):
+        self._known[file_unique_id] = path
+        self._known.move_to_end(file_unique_id)
+        while len(self._known) > self._cache_size:
+            self._known.popitem(last=False)
+
+    async def _worker(self):
+        while True:
+            file_unique_id, ext, message = await self._queue.get()
+            try:
+                await self._download(file_unique_id, ext, message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                logging.error("[MEDIA] Failed to download %s: %s", file_unique_id, e)
+            finally:
+                self._pending.discard(file_unique_id)
+                self._queue.task_done()
+
+    async def _download(self, file_unique_id: str, ext: str, message: Message):
+        tmp_path = await message.download(
+            file_name=os.path.join(self._root, "tmp", file_unique_id + ext)
+        )
+        if not tmp_path:
+            raise RuntimeError("download returned no file")
+        path = await asyncio.to_thread(self._store, file_unique_id, ext, tmp_path)
+        self._remember(file_unique_id, path)
+        self.stats["downloaded"] += 1
+        logging.info("[MEDIA] %s stored at %s", file_unique_id, path)
+
+    def _store(self, file_unique_id: str, ext: str, tmp_path: str) -> str:
+        digest = _sha256(tmp_path)
+        directory = os.path.join(self._root, digest[:2])
+        path = os.path.join(directory, digest + ext)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(directory, exist_ok=True)
+            os.replace(tmp_path, path)
+        with open(
+            os.path.join(self._root, "by-id", file_unique_id), "w", encoding="utf-8"
+        ) as f:
+            f.write(path)
+        return path
@@ -0,0 +1,142 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import time
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from utils import config
+from utils.db import get_mongo_client
+
+DROP_POLICIES = ("block", "oldest", "newest")
+
+_CLOSE = object()
+
+
+def get_log_collection():
+    """The collection incoming messages are logged to"""
+    return get_mongo_client(config.log_mongo_uri)[config.log_mongo_db]["messages"]
+
+
+class MessageLogWriter:
+    """Write-behind buffer for the message log collection.
+
+    Documents are queued from the event loop and flushed by a background
+    task in ``insert_many(ordered=False)`` batches once ``batch_size``
+    documents are pending or the oldest one is ``flush_interval`` seconds old.
+    The blocking driver call runs in a worker thread.
+    """
+
+    def __init__(
+        self,
+        collection,
+        batch_size: int = 100,
+        flush_interval: float = 2.0,
+        max_queue: int = 10000,
+        drop_policy: str = "oldest",
+    ):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Invalid drop policy: {drop_policy}")
+        self._collection = collection
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval
+        self._drop_policy = drop_policy
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+        self.stats = {
+            "queued": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "batches": 0,
+        }
+
+    def ensure_indexes(self):
+        """Indexes for per-chat history and per-user lookups"""
+        self._collection.create_index([("chat_id", 1), ("date", 1)])
+        self._collection.create_index("from_user_id")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def put(self, document: dict):
+        """Queue a document, applying the drop policy when the queue is full"""
+        if self._drop_policy == "block":
+            await self._queue.put(document)
+        elif self._queue.full():
+            self.stats["dropped"] += 1
+            if self._drop_policy == "newest":
+                return
+            self._queue.get_nowait()
+            self._queue.put_nowait(document)
+        else:
+            self._queue.put_nowait(document)
+        self.stats["queued"] += 1
+
+    async def close(self):
+        """Flush everything still queued and stop the background task"""
+        if self._task is None:
+            return
+        await self._queue.put(_CLOSE)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is _CLOSE:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self._flush_interval
+            closing = False
+            while len(batch) < self._batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _CLOSE:
+                    closing = True
+                    break
+                batch.append(item)
+            await self._write(batch)
+            if closing:
+                return
+
+    async def _write(self, batch: list):
+        try:
+            await asyncio.to_thread(self._collection.insert_many, batch, ordered=False)
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+            self.stats["written"] += inserted
+            self.stats["failed"] += len(batch) - inserted
+            logging.error("[LOGGER] Partial batch write: %s", e.details.get("writeErrors"))
+        except PyMongoError as e:
+            self.stats["failed"] += len(batch)
+            logging.error("[LOGGER] Failed to write %d messages: %s", len(batch), e)
+        except Exception as e:
+            # e.g. bson InvalidDocument, drop the batch but keep flushing
+            self.stats["failed"] += len(batch)
+            logging.exception("[LOGGER] Dropped batch of %d messages: %s", len(batch), e)
+        else:
+            self.stats["written"] += len(batch)
+            logging.debug("[MONGODB] %d messages saved", len(batch))
+        self.stats["batches"] += 1
@@ -0,0 +1,169 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import time
+
+from pyrogram import Client
+from pyrogram.errors import (
+    ChannelInvalid,
+    ChannelPrivate,
+    FloodWait,
+    PeerIdInvalid,
+    RPCError,
+    UserIdInvalid,
+)
+from pyrogram.raw import functions, types
+from pyrogram.utils import MAX_USER_ID, get_channel_id
+
+from utils import config
+from utils.db import db
+
+# Telegram accepts at most this many ids per GetUsers/GetChannels
+BATCH_SIZE = 100
+
+# Errors caused by a single bad peer of a batch
+PEER_ERRORS = (ChannelInvalid, ChannelPrivate, PeerIdInvalid, UserIdInvalid)
+
+
+class NameCache:
+    """Display names of users and channels by id, stored in ``core.names``.
+
+    Each entry is ``str(peer_id) -> [name, expiry]`` and is trusted for
+    ``ttl`` seconds. Missing names are fetched with one ``users.GetUsers``
+    or ``channels.GetChannels`` request per 100 ids, using the access
+    hashes the session already has.
+    """
+
+    module = "core.names"
+
+    def __init__(self, ttl: float = 86400):
+        self._ttl = ttl
+        self._names = None
+
+    def _load(self) -> dict:
+        if self._names is None:
+            now = time.time()
+            self._names = {
+                int(peer_id): entry
+                for peer_id, entry in db.get_collection(self.module).items()
+                if entry[1] > now
+            }
+        return self._names
+
+    async def _input_peer(self, client: Client, peer_id: int):
+        try:
+            return await client.storage.get_peer_by_id(peer_id)
+        except (KeyError, ValueError):
+            return None
+
+    async def _fetch_users(self, client: Client, user_ids: list) -> dict:
+        input_users = []
+        for user_id in user_ids:
+            peer = await self._input_peer(client, user_id)
+            input_users.append(
+                types.InputUser(
+                    user_id=user_id,
+                    access_hash=getattr(peer, "access_hash", 0),
+                )
+            )
+        users = await client.invoke(functions.users.GetUsers(id=input_users))
+        return {
+            user.id: user.first_name
+            for user in users
+            if isinstance(user, types.User) and user.first_name
+        }
+
+    async def _fetch_channels(self, client: Client, chat_ids: list) -> dict:
+        input_channels = []
+        for chat_id in chat_ids:
+            peer = await self._input_peer(client, chat_id)
+            input_channels.append(
+                types.InputChannel(
+                    channel_id=get_channel_id(chat_id),
+                    access_hash=getattr(peer, "access_hash", 0),
+                )
+            )
+        result = await client.invoke(functions.channels.GetChannels(id=input_channels))
+        return {get_channel_id(chat.id): chat.title for chat in result.chats}
+
+    async def _fetch(self, client: Client, fetch, ids: list) -> dict:
+        """Fetch a batch, halving it on peer errors to isolate the bad ids"""
+        while True:
+            try:
+                return await fetch(client, ids)
+            except FloodWait as e:
+                # the same batch is retried, splitting it would only flood more
+                await asyncio.sleep(e.value)
+            except PEER_ERRORS:
+                if len(ids) == 1:
+                    return {}
+                break
+            except RPCError as e:
+                logging.warning("[NAMES] Failed to resolve %d ids: %s", len(ids), e)
+                return {}
+        middle = len(ids) // 2
+        found = await self._fetch(client, fetch, ids[:middle])
+        found.update(await self._fetch(client, fetch, ids[middle:]))
+        return found
+
+    async def get_names(self, client: Client, peer_ids) -> dict:
+        """``peer_id -> name`` for every id that could be resolved.
+
+        A batch rejected because of a bad peer (one unknown or deleted peer
+        is enough) is split up and retried, so only the bad ids are missing.
+        """
+        names = self._load()
+        now = time.time()
+        found = {}
+        users, channels = [], []
+        for peer_id in peer_ids:
+            entry = names.get(peer_id)
+            if entry is not None and entry[1] > now:
+                found[peer_id] = entry[0]
+            elif 0 < peer_id <= MAX_USER_ID:
+                users.append(peer_id)
+            elif str(peer_id).startswith("-100"):
+                channels.append(peer_id)
+
+        fetched = {}
+        for ids, fetch in ((users, self._fetch_users), (channels, self._fetch_channels)):
+            for i in range(0, len(ids), BATCH_SIZE):
+                fetched.update(await self._fetch(client, fetch, ids[i : i + BATCH_SIZE]))
+
+        if fetched:
+            expiry = now + self._ttl
+            for peer_id, name in fetched.items():
+                names[peer_id] = [name, expiry]
+            db.set_many(
+                self.module,
+                {str(peer_id): names[peer_id] for peer_id in fetched},
+            )
+            found.update(fetched)
+        return found
+
+    def invalidate(self, peer_id: int):
+        if self._load().pop(peer_id, None) is not None:
+            db.remove(self.module, str(peer_id))
+
+    async def on_raw_update(self, _, update, __, ___):
+        """Raw update handler dropping users who changed their name"""
+        if isinstance(update, types.UpdateUserName):
+            self.invalidate(update.user_id)
+
+
+names = NameCache(config.name_cache_ttl)
@@ -0,0 +1,149 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+from collections import OrderedDict
+
+from pyrogram import Client
+from pyrogram.raw import types
+from pyrogram.types import User
+
+from utils import config
+
+# Raw updates that change what get_users returns for a user
+USER_UPDATES = tuple(
+    getattr(types, name)
+    for name in (
+        "UpdateUser",
+        "UpdateUserName",
+        "UpdateUserPhoto",
+        "UpdateUserEmojiStatus",
+        "UpdateUserPhone",
+    )
+    if hasattr(types, name)
+)
+
+
+class PeerCache:
+    """TTL + LRU cache of users, the own profile and resolved input peers.
+
+    Users are keyed by id and by lower-cased username. Entries expire after
+    ``ttl`` seconds and are dropped early by :meth:`on_raw_update` when
+    Telegram reports a change of that user.
+    """
+
+    def __init__(self, ttl: float = 600, max_size: int = 4096):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._users = OrderedDict()
+        self._peers = OrderedDict()
+        self._me = None
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _get(self, store: OrderedDict, key):
+        entry = store.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            store.pop(key, None)
+            self.stats["misses"] += 1
+            return None
+        store.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[0]
+
+    def _put(self, store: OrderedDict, key, value):
+        store[key] = (value, time.monotonic() + self._ttl)
+        store.move_to_end(key)
+        while len(store) > self._max_size:
+            store.popitem(last=False)
+
+    @staticmethod
+    def _key(user_id):
+        if isinstance(user_id, str) and not user_id.lstrip("-").isdigit():
+            return user_id.lstrip("@").lower()
+        return int(user_id)
+
+    def remember(self, user: User):
+        """Store a user already at hand, e.g. ``message.from_user``"""
+        if user is None:
+            return
+        self._put(self._users, user.id, user)
+        if user.username:
+            self._put(self._users, user.username.lower(), user)
+        if user.is_self:
+            self._me = (user, time.monotonic() + self._ttl)
+
+    async def get_me(self, client: Client) -> User:
+        if self._me is not None and self._me[1] >= time.monotonic():
+            return self._me[0]
+        me = await client.get_me()
+        self.remember(me)
+        return me
+
+    async def get_user(self, client: Client, user_id) -> User:
+        """Cached ``client.get_users`` for a single id or username"""
+        user = self._get(self._users, self._key(user_id))
+        if user is None:
+            user = await client.get_users(user_id)
+            self.remember(user)
+        return user
+
+    async def get_users(self, client: Client, user_ids: list) -> list:
+        """Cached ``client.get_users``, one request for all missing users"""
+        found = {}
+        missing = []
+        for user_id in user_ids:
+            user = self._get(self._users, self._key(user_id))
+            if user is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = user
+        if missing:
+            for user in await client.get_users(missing):
+                self.remember(user)
+            for user_id in missing:
+                entry = self._users.get(self._key(user_id))
+                if entry is not None:
+                    found[user_id] = entry[0]
+        return [found[user_id] for user_id in user_ids if user_id in found]
+
+    async def resolve_peer(self, client: Client, peer_id):
+        peer = self._get(self._peers, peer_id)
+        if peer is None:
+            peer = await client.resolve_peer(peer_id)
+            self._put(self._peers, peer_id, peer)
+        return peer
+
+    def invalidate(self, user_id: int = None):
+        """Forget one user (by id), or everything"""
+        if user_id is None:
+            self._users.clear()
+            self._peers.clear()
+            self._me = None
+            return
+        entry = self._users.pop(user_id, None)
+        if entry is not None and entry[0].username:
+            self._users.pop(entry[0].username.lower(), None)
+        self._peers.pop(user_id, None)
+        if self._me is not None and self._me[0].id == user_id:
+            self._me = None
+
+    async def on_raw_update(self, _, update, __, ___):
+        """Raw update handler dropping users whose profile changed"""
+        if isinstance(update, USER_UPDATES):
+            self.invalidate(update.user_id)
+
+
+peers = PeerCache(config.peer_cache_ttl, config.peer_cache_size)
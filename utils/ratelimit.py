@@ -0,0 +1,121 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """``capacity`` tokens, refilled at ``rate`` tokens per second"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+
+class _LRU(OrderedDict):
+    def __init__(self, max_size: int):
+        super().__init__()
+        self.max_size = max_size
+
+    def put(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.max_size:
+            self.popitem(last=False)
+
+    def touch(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.put(key, value)
+        else:
+            self.move_to_end(key)
+        return value
+
+
+class RateLimiter:
+    """Token buckets per chat and per (chat, key), with hit coalescing.
+
+    Rates are in replies per minute. Repeated hits of the same key in a
+    chat within ``window`` seconds of the last allowed one are coalesced
+    into that reply. :meth:`block` mutes a chat after a FloodWait.
+    """
+
+    def __init__(
+        self,
+        chat_rate: float,
+        chat_burst: int,
+        key_rate: float,
+        key_burst: int,
+        window: float = 0,
+        max_size: int = 4096,
+    ):
+        self._chat_rate = chat_rate / 60
+        self._chat_burst = chat_burst
+        self._key_rate = key_rate / 60
+        self._key_burst = key_burst
+        self._window = window
+        self._chats = _LRU(max_size)
+        self._keys = _LRU(max_size)
+        self._last = _LRU(max_size)
+        self.blocked_until = {}
+        self.stats = {"allowed": 0, "coalesced": 0, "limited": 0, "blocked": 0}
+
+    def allow(self, chat_id: int, key) -> bool:
+        """Take a token for a reply to ``key`` in ``chat_id`` if one is free"""
+        now = time.monotonic()
+        if self.blocked_until.get(chat_id, 0) > now:
+            self.stats["blocked"] += 1
+            return False
+        self.blocked_until.pop(chat_id, None)
+
+        last = self._last.get((chat_id, key))
+        if last is not None and now - last < self._window:
+            self.stats["coalesced"] += 1
+            return False
+
+        chat = self._chats.touch(
+            chat_id, lambda: TokenBucket(self._chat_rate, self._chat_burst)
+        )
+        bucket = self._keys.touch(
+            (chat_id, key), lambda: TokenBucket(self._key_rate, self._key_burst)
+        )
+        if chat.refill(now) < 1 or bucket.refill(now) < 1:
+            self.stats["limited"] += 1
+            return False
+        chat.tokens -= 1
+        bucket.tokens -= 1
+        self._last.put((chat_id, key), now)
+        self.stats["allowed"] += 1
+        return True
+
+    def block(self, chat_id: int, seconds: float):
+        """Refuse every reply in ``chat_id`` for ``seconds``"""
+        now = time.monotonic()
+        for blocked, until in list(self.blocked_until.items()):
+            if until <= now:
+                del self.blocked_until[blocked]
+        self.blocked_until[chat_id] = now + seconds
@@ -0,0 +1,132 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from pyrogram import Client
+from pyrogram.enums import ParseMode
+from pyrogram.errors import FloodWait, RPCError
+from pyrogram.types import (
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+    Message,
+)
+
+from utils.db import db
+
+MEDIA_TYPES = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "audio": InputMediaAudio,
+    "document": InputMediaDocument,
+}
+
+
+def _media_item(message: Message) -> dict | None:
+    for kind in MEDIA_TYPES:
+        media = getattr(message, kind, None)
+        if media:
+            thumbs = getattr(media, "thumbs", None)
+            return {
+                "type": kind,
+                "file_id": media.file_id,
+                "thumb": thumbs[0].file_id if thumbs else None,
+                "caption": message.caption.html if message.caption else None,
+            }
+    return None
+
+
+def _input_media(item: dict):
+    kwargs = {}
+    if item["caption"]:
+        kwargs.update(caption=item["caption"], parse_mode=ParseMode.HTML)
+    if item["thumb"] and item["type"] in ("video", "document"):
+        kwargs["thumb"] = item["thumb"]
+    return MEDIA_TYPES[item["type"]](item["file_id"], **kwargs)
+
+
+class ReplyCache:
+    """Resolved reply payloads of stored filters and notes.
+
+    Media groups are saved as their file_ids, thumbs and HTML captions, keyed
+    by the stored ``CHAT_ID``/``MESSAGE_ID``, so replying is a single
+    ``send_media_group`` call. Single messages need no payload, they are sent
+    with one ``copy_message``. A failed send drops the payload, resolves it
+    again from the stored messages and retries once.
+    """
+
+    module = "core.replies"
+
+    @staticmethod
+    def _key(chat_id, message_id) -> str:
+        return f"{chat_id}_{message_id}"
+
+    def store(self, chat_id, message_id, messages: list) -> list:
+        """Cache the layout of an already fetched media group"""
+        layout = [item for item in map(_media_item, messages) if item]
+        db.set(self.module, self._key(chat_id, message_id), layout)
+        return layout
+
+    def forget(self, chat_id, message_id):
+        db.remove(self.module, self._key(chat_id, message_id))
+
+    async def resolve(self, client: Client, chat_id, message_id) -> list:
+        messages = await client.get_media_group(int(chat_id), int(message_id))
+        return self.store(chat_id, message_id, messages)
+
+    async def get(self, client: Client, chat_id, message_id) -> list:
+        layout = await db.aget(self.module, self._key(chat_id, message_id))
+        if layout is None:
+            layout = await self.resolve(client, chat_id, message_id)
+        return layout
+
+    async def send(
+        self, client: Client, chat_id: int, value: dict, reply_to_message_id=None
+    ):
+        """Send a stored filter/note ``value`` to ``chat_id``.
+
+        Raises RPCError when the stored message is no longer available.
+        """
+        source_chat, source_id = value["CHAT_ID"], value["MESSAGE_ID"]
+        if not value.get("MEDIA_GROUP"):
+            return await client.copy_message(
+                chat_id,
+                int(source_chat),
+                int(source_id),
+                reply_to_message_id=reply_to_message_id,
+            )
+
+        layout = await self.get(client, source_chat, source_id)
+        try:
+            return await client.send_media_group(
+                chat_id,
+                [_input_media(item) for item in layout],
+                reply_to_message_id=reply_to_message_id,
+            )
+        except FloodWait:
+            raise
+        except RPCError:
+            # file references expire and the stored messages can be edited
+            self.forget(source_chat, source_id)
+            layout = await self.resolve(client, source_chat, source_id)
+            return await client.send_media_group(
+                chat_id,
+                [_input_media(item) for item in layout],
+                reply_to_message_id=reply_to_message_id,
+            )
+
+
+reply_cache = ReplyCache()
@@ -219,6 +219,7 @@ def restart() -> None:
             music_bot_process.terminate()
         except psutil.NoSuchProcess:
             print("Music bot is not running.")
+    db.flush()
     os.execvp(sys.executable, [sys.executable, "main.py"]) # skipcq
 
 
@@ -0,0 +1,130 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import re
+import time
+
+from utils.db import db
+
+LEGACY_KEY = re.compile(r"^c(-?\d+)$")
+
+
+class TmuteStore:
+    """Users whose new messages are deleted, per chat, with optional expiry.
+
+    Every entry is its own ``core.tmute`` key, ``{chat_id}_{user_id}`` ->
+    expiry timestamp (0 = forever), so muting or unmuting one user writes
+    one key. The whole store lives in memory as ``chat_id -> {user_id:
+    expiry}``, loaded on first use together with the old ``core.ats``
+    ``c{chat_id}`` lists, which are migrated and removed.
+    """
+
+    module = "core.tmute"
+
+    def __init__(self):
+        self._chats = None
+
+    @staticmethod
+    def _key(chat_id: int, user_id: int) -> str:
+        return f"{chat_id}_{user_id}"
+
+    def _load(self) -> dict:
+        if self._chats is None:
+            chats = {}
+            for key, expiry in db.get_collection(self.module).items():
+                chat_id, user_id = key.rsplit("_", 1)
+                chats.setdefault(int(chat_id), {})[int(user_id)] = expiry
+            self._migrate(chats)
+            self._chats = chats
+        return self._chats
+
+    def _migrate(self, chats: dict):
+        legacy = {
+            var: value
+            for var, value in db.get_prefix("core.ats", "c").items()
+            if LEGACY_KEY.match(var)
+        }
+        if not legacy:
+            return
+        values = {}
+        for var, user_ids in legacy.items():
+            chat_id = int(LEGACY_KEY.match(var).group(1))
+            for user_id in user_ids:
+                chats.setdefault(chat_id, {})[user_id] = 0
+                values[self._key(chat_id, user_id)] = 0
+        with db.transaction():
+            db.set_many(self.module, values)
+            db.remove_many("core.ats", list(legacy))
+        logging.info("Migrated %d tmuted users to %s", len(values), self.module)
+
+    def is_muted(self, chat_id: int, user_id: int) -> bool:
+        expiry = self._load().get(chat_id, {}).get(user_id)
+        return expiry is not None and (not expiry or expiry > time.time())
+
+    def users(self, chat_id: int) -> dict:
+        """Muted users of a chat as ``user_id -> expiry``"""
+        now = time.time()
+        return {
+            user_id: expiry
+            for user_id, expiry in self._load().get(chat_id, {}).items()
+            if not expiry or expiry > now
+        }
+
+    def add(self, chat_id: int, user_id: int, seconds: float = 0) -> bool:
+        """Mute a user, for ``seconds`` or forever. False if already muted"""
+        if self.is_muted(chat_id, user_id):
+            return False
+        expiry = time.time() + seconds if seconds else 0
+        self._load().setdefault(chat_id, {})[user_id] = expiry
+        db.set(self.module, self._key(chat_id, user_id), expiry)
+        return True
+
+    def remove(self, chat_id: int, user_id: int) -> bool:
+        """Unmute a user. False if the user wasn't muted"""
+        muted = self.is_muted(chat_id, user_id)
+        if self._load().get(chat_id, {}).pop(user_id, None) is not None:
+            db.remove(self.module, self._key(chat_id, user_id))
+        return muted
+
+    def sweep(self) -> int:
+        """Drop expired entries with one batched write, returns how many"""
+        now = time.time()
+        expired = []
+        for chat_id, users in self._load().items():
+            for user_id, expiry in list(users.items()):
+                if expiry and expiry <= now:
+                    del users[user_id]
+                    expired.append(self._key(chat_id, user_id))
+        if expired:
+            db.remove_many(self.module, expired)
+        return len(expired)
+
+    async def sweeper(self, interval: float = 60):
+        """Background task lifting expired mutes"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                lifted = self.sweep()
+            except Exception as e:
+                logging.error("[TMUTE] Sweep failed: %s", e)
+                continue
+            if lifted:
+                logging.info("[TMUTE] Lifted %d expired mutes", lifted)
+
+
+tmutes = TmuteStore()
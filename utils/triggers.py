@@ -0,0 +1,341 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import fnmatch
+import logging
+import multiprocessing
+import re
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import regex
+except ImportError:
+    regex = None
+
+MODES = ("exact", "prefix", "contains", "regex", "glob")
+PATTERN_MODES = ("regex", "glob")
+
+# Numbered backreferences would point at the wrong group once combined
+_BACKREF = re.compile(r"\\[1-9]|\(\?P=")
+# Leading global flags, only valid at the very start of a pattern
+_GLOBAL_FLAGS = re.compile(r"\A\(\?([aiLmsux]+)\)")
+
+PATTERN_ERRORS = (re.error,) if regex is None else (re.error, regex.error)
+
+
+def compile_trigger(trigger: str, mode: str) -> str:
+    """Regex source for a regex/glob trigger, raises re.error if invalid.
+
+    Leading global flags like ``(?i)`` are turned into a scoped group so
+    the source can be part of an alternation; ``a``/``L``/``u`` can't be
+    scoped and are rejected.
+    """
+    if mode == "regex":
+        source = trigger
+        flags = _GLOBAL_FLAGS.match(trigger)
+        if flags is not None:
+            if set(flags.group(1)) - set("imsx"):
+                raise re.error(f"unsupported global flags {flags.group()}")
+            source = f"(?{flags.group(1)}:{trigger[flags.end():]})"
+    else:
+        source = r"\A" + fnmatch.translate(trigger)
+    re.compile(source, re.IGNORECASE)
+    return source
+
+
+def search_patterns(patterns: list, text: str, timeout: float = None):
+    """Position ``(i, j)`` of the first matching trigger in ``patterns``.
+
+    ``patterns`` is a list of ``(source, trigger_count)``; combined sources
+    name their alternatives ``_t<j>``. With the ``regex`` package the
+    search is aborted with TimeoutError after ``timeout`` seconds.
+    """
+    for i, (source, count) in enumerate(patterns):
+        if regex is not None:
+            found = regex.search(
+                source,
+                text,
+                regex.IGNORECASE,
+                timeout=timeout,
+                concurrent=True,
+            )
+        else:
+            found = re.search(source, text, re.IGNORECASE)
+        if found is not None:
+            return i, 0 if count == 1 else int(found.lastgroup[2:])
+    return None
+
+
+class _PatternRunner:
+    """Runs pattern searches off the event loop under a time limit.
+
+    The ``regex`` package releases the GIL and has native timeouts, so a
+    thread is enough. The stdlib ``re`` holds the GIL for a whole search, so
+    without it searches run one at a time in a child process, and the pool
+    is terminated and replaced on timeout. Only the search itself is timed,
+    not the wait for a free worker.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._pool = None
+        self._slots = None
+
+    async def _apply(self, func, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result, error=None):
+            if future.done():
+                return
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+        self._pool.apply_async(
+            func,
+            args,
+            callback=lambda result: loop.call_soon_threadsafe(resolve, result),
+            error_callback=lambda error: loop.call_soon_threadsafe(
+                resolve, None, error
+            ),
+        )
+        return await future
+
+    async def search(self, patterns: list, text: str, timeout: float):
+        loop = asyncio.get_running_loop()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(2 if regex is not None else 1)
+        async with self._slots:
+            if regex is not None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=2, thread_name_prefix="triggers"
+                    )
+                try:
+                    return await loop.run_in_executor(
+                        self._executor, search_patterns, patterns, text, timeout
+                    )
+                except TimeoutError:
+                    raise asyncio.TimeoutError from None
+
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(1)
+                # don't count the worker start-up against the first search
+                await self._apply(int)
+            try:
+                return await asyncio.wait_for(
+                    self._apply(search_patterns, patterns, text), timeout
+                )
+            except asyncio.TimeoutError:
+                # nothing else runs in this pool, terminating it is safe
+                pool, self._pool = self._pool, None
+                loop.run_in_executor(None, pool.terminate)
+                raise
+
+
+_runner = _PatternRunner()
+
+
+class TriggerIndex:
+    """All triggers of one chat, matched in a single pass over the text.
+
+    Exact triggers are a dict lookup; prefix and substring triggers share an
+    Aho–Corasick automaton. Triggers are expected in lower case, except for
+    regexes. Regex and glob triggers are compiled into a single alternation.
+    """
+
+    def __init__(self, triggers: dict):
+        """``triggers`` maps a trigger to its filter dict (with optional MODE)"""
+        self.triggers = triggers
+        self._exact = set()
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        self.patterns = []
+
+        combined = {}
+        for trigger, value in triggers.items():
+            mode = value.get("MODE", "exact")
+            if mode == "exact":
+                self._exact.add(trigger)
+            elif mode in PATTERN_MODES:
+                try:
+                    source = compile_trigger(trigger, mode)
+                except re.error as e:
+                    logging.warning("Skipping invalid trigger %r: %s", trigger, e)
+                    continue
+                if _BACKREF.search(source):
+                    self.patterns.append((source, (trigger,)))
+                else:
+                    combined[trigger] = source
+            elif trigger:
+                self._add(trigger)
+        self._build()
+
+        if combined:
+            # one alternation for all patterns, the named group tells which hit
+            alternation = "|".join(
+                f"(?P<_t{i}>{source})" for i, source in enumerate(combined.values())
+            )
+            try:
+                re.compile(alternation, re.IGNORECASE)
+            except re.error as e:
+                # e.g. the same group name in two triggers, search them one by one
+                logging.debug("Can't combine trigger patterns: %s", e)
+                self.patterns[:0] = [
+                    (source, (trigger,)) for trigger, source in combined.items()
+                ]
+            else:
+                self.patterns.insert(0, (alternation, tuple(combined)))
+
+    def __bool__(self):
+        return bool(self.triggers)
+
+    def _add(self, trigger: str):
+        node = 0
+        for char in trigger:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            node = nxt
+        self._out[node] = (trigger,)
+
+    def _build(self):
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for char, nxt in self._goto[node].items():
+                queue.append(nxt)
+                state = self._fail[node]
+                while state and char not in self._goto[state]:
+                    state = self._fail[state]
+                fail = self._goto[state].get(char, 0)
+                self._fail[nxt] = fail if fail != nxt else 0
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def find_all(self, text: str) -> list:
+        """Every prefix/substring trigger occurring in ``text`` as (start, trigger)"""
+        found = []
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for pos, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for trigger in out[node]:
+                start = pos - len(trigger) + 1
+                if start == 0 or self.triggers[trigger].get("MODE") == "contains":
+                    found.append((start, trigger))
+        return found
+
+    def match(self, text: str) -> str | None:
+        """The best plain trigger for ``text``: an exact match, else the longest"""
+        if not text:
+            return None
+        text = text.lower()
+        if text in self._exact:
+            return text
+        if len(self._goto) == 1:
+            return None
+        found = self.find_all(text)
+        if not found:
+            return None
+        return min(found, key=lambda item: (-len(item[1]), item[0]))[1]
+
+    def match_patterns(self, text: str) -> str | None:
+        """The first regex/glob trigger matching ``text``, this may be slow"""
+        found = search_patterns(self.pattern_sources, text)
+        return None if found is None else self.patterns[found[0]][1][found[1]]
+
+    @property
+    def pattern_sources(self) -> list:
+        return [(source, len(triggers)) for source, triggers in self.patterns]
+
+
+class TriggerCache:
+    """Per-chat :class:`TriggerIndex` objects, built on first use.
+
+    ``loader`` is an async callable returning the trigger dict of a chat.
+    Chats without triggers are cached too, so most messages never reach the
+    database; the least recently used chats are evicted past ``max_size``.
+
+    Regex/glob triggers are evaluated off the event loop for at most
+    ``timeout`` seconds. A chat whose patterns time out has them disabled
+    until its filters change.
+    """
+
+    def __init__(self, loader, max_size: int = 1024, timeout: float = 0.1):
+        self._loader = loader
+        self._max_size = max_size
+        self._timeout = timeout
+        self._indexes = OrderedDict()
+        self.hits = {}
+
+    async def get(self, chat_id: int) -> TriggerIndex:
+        index = self._indexes.get(chat_id)
+        if index is None:
+            index = TriggerIndex(await self._loader(chat_id))
+            self._indexes[chat_id] = index
+            while len(self._indexes) > self._max_size:
+                self._indexes.popitem(last=False)
+        else:
+            self._indexes.move_to_end(chat_id)
+        return index
+
+    async def match(self, chat_id: int, text: str) -> tuple | None:
+        """The matching ``(trigger, value)`` for a message, counting the hit"""
+        index = await self.get(chat_id)
+        if not index or not text:
+            return None
+        trigger = index.match(text)
+        if trigger is None and index.patterns:
+            try:
+                found = await _runner.search(
+                    index.pattern_sources, text, self._timeout
+                )
+            except asyncio.TimeoutError:
+                logging.warning(
+                    "Trigger patterns of chat %s took longer than %ss, disabling them",
+                    chat_id,
+                    self._timeout,
+                )
+                index.patterns = []
+                found = None
+            except PATTERN_ERRORS as e:
+                logging.warning(
+                    "Trigger patterns of chat %s failed, disabling them: %s", chat_id, e
+                )
+                index.patterns = []
+                found = None
+            if found is not None:
+                trigger = index.patterns[found[0]][1][found[1]]
+        if trigger is None:
+            return None
+        self.hits.setdefault(chat_id, Counter())[trigger] += 1
+        return trigger, index.triggers[trigger]
+
+    def invalidate(self, chat_id: int = None):
+        if chat_id is None:
+            self._indexes.clear()
+        else:
+            self._indexes.pop(chat_id, None)